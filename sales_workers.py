@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Функции, которые выполняются в дочерних процессах пула
+
+Модуль импортируется по имени, поэтому функции доступны процессам,
+запущенным через forkserver или spawn, без копирования состояния сервера.
+"""
+
+import warnings
+from contextlib import closing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+QUARTILES = (0.25, 0.5, 0.75)
+
+# Размер буфера уровня в квантильном эскизе: больше - точнее, но больше памяти
+SKETCH_K = 512
+# Строк в блоке, которым матрица подается в эскиз
+SKETCH_BLOCK_ROWS = 100_000
+
+
+def read_excel_sheet(path, sheet_name):
+    """Чтение одного листа Excel (выполняется в дочернем процессе)"""
+    return pd.read_excel(path, sheet_name=sheet_name)
+
+
+def column_block_statistics(shm_name, shape, start, stop, quantiles, approximate=False):
+    """Статистики блока столбцов матрицы из общей памяти (выполняется в пуле)"""
+    memory = shared_memory.SharedMemory(name=shm_name)
+    with closing(memory):
+        # Копия блока, чтобы после закрытия не оставалось ссылок на общую память
+        block = np.ndarray(shape, dtype=np.float64, buffer=memory.buf,
+                           order='F')[:, start:stop].copy(order='F')
+    if approximate:
+        return sketch_sales_statistics(block)
+    return compute_sales_statistics(block, quantiles)
+
+
+def compute_sales_statistics(values, quantiles=True):
+    """Статистики describe(), суммы по продуктам и по периодам для матрицы продаж
+
+    Все показатели считаются векторно по одному непрерывному массиву float64:
+    первый проход - суммы, количества, минимумы и максимумы, второй - дисперсия,
+    квартили - через np.quantile (частичная сортировка) по каждому столбцу.
+    При quantiles=False квартили не считаются (остаются NaN).
+    """
+    # Порядок Fortran: значения каждого продукта лежат в памяти подряд
+    values = np.asarray(values, dtype=np.float64, order='F')
+    n_rows, n_products = values.shape
+    missing = np.isnan(values)
+
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if missing.any():
+            counts = n_rows - missing.sum(axis=0)
+            filled = np.where(missing, 0.0, values)
+            totals = filled.sum(axis=0)
+            row_totals = filled.sum(axis=1)
+            means = totals / counts
+            squares = np.where(missing, 0.0, (values - means) ** 2).sum(axis=0)
+            mins = np.nanmin(values, axis=0)
+            maxs = np.nanmax(values, axis=0)
+            quartiles = (np.nanquantile(values, QUARTILES, axis=0) if quantiles
+                         else np.full((3, n_products), np.nan))
+        else:
+            counts = np.full(n_products, n_rows)
+            totals = values.sum(axis=0)
+            row_totals = values.sum(axis=1)
+            means = totals / n_rows
+            squares = ((values - means) ** 2).sum(axis=0)
+            mins = values.min(axis=0, initial=np.inf)
+            maxs = values.max(axis=0, initial=-np.inf)
+            quartiles = (np.quantile(values, QUARTILES, axis=0) if n_rows and quantiles
+                         else np.full((3, n_products), np.nan))
+        stds = np.sqrt(squares / (counts - 1))
+
+    has_values = counts > 0
+    stats = {
+        'count': counts.astype(np.float64),
+        'mean': np.where(has_values, means, np.nan),
+        'std': np.where(counts > 1, stds, np.nan),
+        'min': np.where(has_values, mins, np.nan),
+        '25%': quartiles[0],
+        '50%': quartiles[1],
+        '75%': quartiles[2],
+        'max': np.where(has_values, maxs, np.nan),
+    }
+    return stats, totals, row_totals
+
+
+def sketch_sales_statistics(values, block_rows=SKETCH_BLOCK_ROWS):
+    """compute_sales_statistics с квартилями по квантильному эскизу за один проход
+
+    Граница ошибки ранга по каждому столбцу возвращается в stats['rank_error'].
+    """
+    values = np.asarray(values, dtype=np.float64)
+    stats, totals, row_totals = compute_sales_statistics(values, quantiles=False)
+    sketch = QuantileSketch(values.shape[1])
+    for start in range(0, values.shape[0], block_rows):
+        sketch.update(values[start:start + block_rows])
+    stats['25%'], stats['50%'], stats['75%'] = sketch.quantiles(QUARTILES)
+    stats['rank_error'] = sketch.error_bound()
+    return stats, totals, row_totals
+
+
+class QuantileSketch:
+    """Сливаемый квантильный эскиз (в духе KLL) сразу для всех столбцов матрицы
+
+    Значения копятся в уровнях: элемент уровня h заменяет 2**h исходных.
+    Заполненный уровень сортируется и каждый второй элемент переходит на
+    уровень выше, поэтому память ограничена O(k log(n/k)) на столбец.
+    Каждое сжатие уровня h сдвигает ранг любого значения не более чем на 2**h;
+    сумма этих сдвигов - детерминированная граница ошибки ранга.
+    """
+
+    def __init__(self, n_columns, k=SKETCH_K):
+        self.n_columns = n_columns
+        self.k = k
+        self.levels = [np.empty((0, n_columns))]
+        self.counts = np.zeros(n_columns, dtype=np.int64)
+        self.rank_error = 0
+        self._offsets = [0]
+
+    def update(self, values):
+        """Учет блока строк (строки x столбцы), пропуски не учитываются"""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.n_columns)
+        self.counts += (~np.isnan(values)).sum(axis=0)
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compact()
+
+    def merge(self, other):
+        """Слияние с эскизом другой части данных (порции, процесса)"""
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty((0, self.n_columns)))
+                self._offsets.append(0)
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.counts += other.counts
+        self.rank_error += other.rank_error
+        self._compact()
+        return self
+
+    def _compact(self):
+        """Сжатие переполненных уровней снизу вверх"""
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if items.shape[0] >= 2 * self.k:
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty((0, self.n_columns)))
+                    self._offsets.append(0)
+                # NaN сортируются в конец и сжимаются вместе с остальными строками
+                items = np.sort(items, axis=0)
+                paired = items.shape[0] - items.shape[0] % 2
+                offset = self._offsets[level]
+                self._offsets[level] ^= 1
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1],
+                                                         items[offset:paired:2]))
+                self.levels[level] = items[paired:]
+                self.rank_error += 2 ** level
+            level += 1
+
+    def quantiles(self, qs=QUARTILES):
+        """Квантили по столбцам (строки - уровни qs); без сжатий - точные"""
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.rank_error == 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                if self.levels[0].shape[0] == 0:
+                    return np.full((qs.size, self.n_columns), np.nan)
+                return np.nanquantile(self.levels[0], qs, axis=0)
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(items.shape[0], 2.0 ** level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        ordered = np.take_along_axis(values, order, axis=0)
+        cumulative = np.cumsum(np.where(np.isnan(ordered), 0.0, weights[order]), axis=0)
+
+        # Первое значение, накопленный вес которого достигает доли q от общего
+        result = np.full((qs.size, self.n_columns), np.nan)
+        has_values = cumulative[-1] > 0
+        for i, q in enumerate(qs):
+            positions = np.argmax(cumulative >= q * cumulative[-1], axis=0)
+            result[i] = np.where(has_values, ordered[positions, np.arange(self.n_columns)],
+                                 np.nan)
+        return result
+
+    def error_bound(self):
+        """Граница ошибки ранга в долях количества значений каждого столбца"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.rank_error / self.counts, np.nan)
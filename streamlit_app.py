@@ -6,10 +6,42 @@ Streamlit приложение для анализа данных о прода
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import openpyxl
 import matplotlib.pyplot as plt
 import seaborn as sns
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import io
+import os
+import sys
+import copy
+import hashlib
+import heapq
+import pickle
+import re
+import tempfile
+import threading
+import time
+import warnings
+import multiprocessing
+from collections import OrderedDict
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
 from datetime import datetime
+from sales_workers import (QUARTILES, QuantileSketch, compute_sales_statistics,
+                           sketch_sales_statistics, read_excel_sheet, column_block_statistics)
+
+# Plotly необязателен: без него доступны только графики matplotlib
+try:
+    import plotly.graph_objects as go
+except ImportError:
+    go = None
 
 # Настройка страницы
 st.set_page_config(
@@ -18,56 +50,1987 @@ st.set_page_config(
     layout="wide"
 )
 
+# Ограничения кэша разобранных файлов (на сессию)
+PARSE_CACHE_MAX_ENTRIES = 32
+PARSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
 
-def analyze_sales_data(df):
-    """Функция для анализа данных о продажах"""
-    results = {}
+# Поддерживаемые форматы загружаемых файлов
+EXCEL_EXTENSIONS = ('xlsx', 'xls')
+COLUMNAR_EXTENSIONS = ('csv', 'parquet', 'feather')
+
+# Каталог колоночных копий загруженных наборов данных (общий для всех сессий)
+DATASET_STORE_DIR = os.environ.get(
+    'SALES_DATASET_STORE', os.path.join(tempfile.gettempdir(), 'sales_dataset_store'))
+DATASET_STORE_MAX_FILES = 32
+
+# Форматы дат, проверяемые при определении столбца с датами (dd.mm раньше mm/dd)
+DATE_FORMATS = (
+    '%Y-%m-%d', '%d.%m.%Y', '%d.%m.%y', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d',
+    '%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%Y-%m', '%m.%Y',
+)
+DATE_SAMPLE_SIZE = 200
+
+# Названия столбцов, допускающие даты в виде порядковых номеров Excel
+# (слово должно быть первым в названии: «Дата продажи», но не «Продажи в день»)
+DATE_NAME_HINTS = ('дата', 'date', 'период', 'месяц', 'period', 'month', 'день', 'day')
+EXCEL_SERIAL_RANGE = (20000, 80000)  # примерно 1954-2119 годы
+
+# Доля уникальных значений, при которой текстовый столбец хранится как категория
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# Периоды сведения транзакций в широкую таблицу и ограничение ее размера
+PIVOT_FREQUENCIES = {'Месяц': 'M', 'Неделя': 'W', 'День': 'D'}
+PIVOT_MAX_CELLS = 50_000_000
+
+# Excel файлы от этого размера разбираются в фоновом потоке с индикатором прогресса
+BACKGROUND_PARSE_MIN_BYTES = 5 * 1024 * 1024
+PROGRESS_ROWS_STEP = 1000
+PROGRESS_POLL_SECONDS = 0.5
+
+# Порции при чтении файлов больше памяти: строк (Excel, Parquet, Feather) и байт (CSV)
+CHUNK_ROWS = 100_000
+CSV_CHUNK_BYTES = 16 * 1024 * 1024
+STREAM_EXTENSIONS = ('xlsx',) + COLUMNAR_EXTENSIONS
+
+# Строки описательной статистики в порядке DataFrame.describe()
+DESCRIBE_INDEX = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+# Кэш тяжелых результатов анализа (корреляции, сводки по периодам) по отпечатку данных
+ANALYSIS_CACHE_MAX_ENTRIES = 16
+ANALYSIS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Размер рейтингов по умолчанию и наибольший, число столбцов на графике продаж
+TOP_K_DEFAULT = 3
+TOP_K_MAX = 50
+BAR_CHART_MAX_PRODUCTS = 30
+
+# Широкие таблицы от этих размеров считаются блоками столбцов в пуле процессов
+PARALLEL_MIN_COLUMNS = 256
+PARALLEL_MIN_CELLS = 2_000_000
+# Сколько секунд ждать пул процессов, прежде чем досчитать в текущем процессе
+POOL_TIMEOUT_SECONDS = 120
+
+# Бюджет точек линейного графика (LTTB) и порог, до которого рисуются маркеры
+LINE_CHART_MAX_POINTS = 1000
+LINE_CHART_MARKER_MAX_POINTS = 200
+
+# Кэш растеризованных графиков между перезапусками и их разрешение
+CHART_CACHE_MAX_ENTRIES = 48
+CHART_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CHART_DPI = 100
+
+# Разделы анализа, которые строятся только при выборе
+ANALYSIS_SECTIONS = ['Статистика', 'Ключевые показатели', 'Графики', 'Отчет']
+ALL_SECTIONS = 'Все разделы'
+
+# Интерактивные графики: WebGL для длинных рядов, бюджет точек и подписи ячеек
+CHART_BACKENDS = {'Статичные (matplotlib)': 'matplotlib', 'Интерактивные (Plotly)': 'plotly'}
+PLOTLY_WEBGL_MIN_POINTS = 1000
+PLOTLY_MAX_POINTS = 100_000
+HEATMAP_ANNOTATION_MAX_PRODUCTS = 30
+
+# Подписи осей растровой карты корреляций и размер таблицы связанных пар
+HEATMAP_TICK_MAX_PRODUCTS = 80
+CORRELATION_TOP_PAIRS = 10
+
+# Окно скользящего среднего и сдвиг для роста год к году (в периодах)
+ROLLING_WINDOW = 3
+YOY_LAG = 12
+
+# Уровни сводки по времени и уровень, из которого строится каждый из них
+ROLLUP_LEVELS = {'День': 'D', 'Неделя': 'W', 'Месяц': 'M', 'Квартал': 'Q', 'Год': 'Y'}
+ROLLUP_SOURCES = {'W': 'D', 'M': 'D', 'Q': 'M', 'Y': 'Q'}
+
+
+class LRUCache:
+    """LRU-кэш с ограничением по количеству записей и объему памяти"""
+
+    def __init__(self, max_entries=8, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Получение значения с обновлением порядка использования"""
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value, size=None):
+        """Добавление значения с вытеснением давно не использованных записей"""
+        if key in self._data:
+            self._drop(key)
+        if size is None:
+            size = estimate_size(value)
+
+        # Объект больше всего кэша не сохраняем, чтобы не вытеснить остальное
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+
+        self._data[key] = value
+        self._sizes[key] = size
+        self.total_bytes += size
+        while (len(self._data) > self.max_entries
+               or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self._drop(next(iter(self._data)))
+        return value
+
+    def clear(self):
+        """Очистка кэша"""
+        self._data.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    def _drop(self, key):
+        del self._data[key]
+        self.total_bytes -= self._sizes.pop(key)
+
+
+def estimate_size(value):
+    """Оценка объема памяти, занимаемого объектом, в байтах"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def format_bytes(size):
+    """Человекочитаемое представление объема памяти"""
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:,.1f} {unit}"
+        size /= 1024
+    return f"{size:,.1f} ГБ"
+
+
+def get_session_cache(name, max_entries=8, max_bytes=None):
+    """Получение кэша, сохраняемого между перезапусками скрипта в session_state"""
+    cache = st.session_state.get(name)
+    if not isinstance(cache, LRUCache):
+        cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        st.session_state[name] = cache
+    return cache
+
+
+def file_content_hash(data):
+    """Хэш содержимого файла для использования в качестве ключа кэша"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def uploaded_file_key(uploaded_file):
+    """Хэш содержимого загруженного файла (один раз на каждую загрузку в сессии)"""
+    file_id = getattr(uploaded_file, 'file_id', None)
+    if not isinstance(file_id, str):
+        return file_content_hash(uploaded_file.getvalue())
+
+    hashes = st.session_state.get('file_hashes')
+    if not isinstance(hashes, dict):
+        hashes = {}
+        st.session_state['file_hashes'] = hashes
+    if file_id not in hashes:
+        hashes[file_id] = file_content_hash(uploaded_file.getvalue())
+    return hashes[file_id]
+
+
+def file_extension(filename):
+    """Расширение файла в нижнем регистре без точки"""
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def read_uploaded_bytes(data, filename):
+    """Разбор содержимого загруженного файла в DataFrame по расширению имени"""
+    extension = file_extension(filename)
+
+    # Колоночные форматы читаются через pyarrow в Arrow-типы без лишних копий
+    if extension == 'csv':
+        return pd.read_csv(io.BytesIO(data), engine='pyarrow', dtype_backend='pyarrow')
+    if extension == 'parquet':
+        return pd.read_parquet(io.BytesIO(data), engine='pyarrow', dtype_backend='pyarrow')
+    if extension == 'feather':
+        return pd.read_feather(io.BytesIO(data), dtype_backend='pyarrow')
+    return pd.read_excel(io.BytesIO(data))
+
+
+def _compact_column(series):
+    """Компактное представление столбца: int32, float32 без потерь, категории"""
+    dtype = series.dtype
+    is_arrow = isinstance(dtype, pd.ArrowDtype)
+
+    if pd.api.types.is_integer_dtype(dtype) and series.dtype.itemsize > 4:
+        info = np.iinfo(np.int32)
+        if series.empty or (series.min() >= info.min and series.max() <= info.max):
+            return series.astype(pd.ArrowDtype(pa.int32()) if is_arrow else np.int32)
+        return series
+
+    if pd.api.types.is_float_dtype(dtype) and series.dtype.itemsize > 4:
+        # float32 только если значения восстанавливаются без потери точности
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        with np.errstate(over='ignore'):
+            compact = values.astype(np.float32)
+        if np.array_equal(compact.astype(np.float64), values, equal_nan=True):
+            return series.astype(pd.ArrowDtype(pa.float32()) if is_arrow else np.float32)
+        return series
+
+    if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)) \
+            and not isinstance(dtype, pd.CategoricalDtype):
+        if series.nunique(dropna=False) <= CATEGORY_MAX_UNIQUE_RATIO * len(series):
+            return series.astype('category')
+    return series
+
+
+def optimize_dtypes(df):
+    """Уменьшение объема памяти DataFrame перед сохранением в сессии"""
+    original_memory = df.attrs.get('original_memory', estimate_size(df))
+
+    # Даты разбираются один раз при загрузке, а не при каждом анализе
+    date_position, date_format = detect_date_column(df)
+
+    compact = df.copy(deep=False)
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if position == date_position:
+            try:
+                compact.isetitem(position, parse_dates(series, date_format))
+            except (ValueError, TypeError, OverflowError):
+                pass
+        else:
+            compact.isetitem(position, _compact_column(series))
+
+    compact.attrs['original_memory'] = original_memory
+    return compact
+
+
+def dataset_store_path(key, store_dir):
+    """Путь к колоночной копии набора данных в хранилище"""
+    return os.path.join(store_dir, f'{key}.arrow')
+
+
+def save_dataset(key, df, store_dir, max_files=DATASET_STORE_MAX_FILES):
+    """Сохранение DataFrame в несжатый Arrow IPC (Feather) файл под ключом-хэшем"""
+    os.makedirs(store_dir, exist_ok=True)
+    path = dataset_store_path(key, store_dir)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if 'original_memory' in df.attrs:
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'original_memory'] = str(df.attrs['original_memory']).encode('ascii')
+        table = table.replace_schema_metadata(metadata)
+
+    # Запись в уникальный временный файл и атомарная замена: сессии - потоки одного
+    # процесса, поэтому каждой нужен свой файл, и никто не увидит половину записи
+    handle, temp_path = tempfile.mkstemp(dir=store_dir, suffix='.tmp')
+    os.close(handle)
+    try:
+        feather.write_feather(table, temp_path, compression='uncompressed')
+        os.replace(temp_path, path)
+    except (pa.ArrowException, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Удаление давно не использованных наборов сверх лимита
+    stored = sorted((entry for entry in os.scandir(store_dir) if entry.name.endswith('.arrow')),
+                    key=lambda entry: entry.stat().st_mtime)
+    for entry in stored[:max(len(stored) - max_files, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return path
+
+
+def load_stored_dataset(key, store_dir):
+    """Загрузка набора данных из хранилища через memory map (None, если его нет)"""
+    path = dataset_store_path(key, store_dir)
+    if not os.path.exists(path):
+        return None
+
+    # Arrow-типы ссылаются на отображенный в память файл без копирования в numpy
+    table = feather.read_table(path, memory_map=True)
+    os.utime(path)
+    df = table.to_pandas(types_mapper=_arrow_types_mapper)
+
+    metadata = table.schema.metadata or {}
+    if b'original_memory' in metadata:
+        df.attrs['original_memory'] = int(metadata[b'original_memory'])
+    return df
+
+
+def _arrow_types_mapper(arrow_type):
+    """Arrow-типы для столбцов из хранилища (словари читаются как категории)"""
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+
+def _lookup_dataset(key, cache=None, store_dir=None):
+    """Поиск уже разобранного набора данных в кэше сессии и в хранилище"""
+    # При перезапуске скрипта повторный разбор не нужен
+    if cache is not None:
+        df = cache.get(key)
+        if df is not None:
+            return df
+
+    df = None
+    if store_dir is not None:
+        try:
+            df = load_stored_dataset(key, store_dir)
+        except (pa.ArrowException, OSError, ValueError, TypeError):
+            # Поврежденный файл хранилища - промах кэша: файл удаляется и разбирается заново
+            try:
+                os.remove(dataset_store_path(key, store_dir))
+            except OSError:
+                pass
+    if df is not None and cache is not None:
+        cache.put(key, df)
+    return df
+
+
+def _remember_dataset(key, df, cache=None, store_dir=None):
+    """Сохранение разобранного набора данных в хранилище и кэше сессии"""
+    # Однократное преобразование в колоночный формат для следующих загрузок
+    if store_dir is not None and all(isinstance(name, str) for name in df.columns):
+        try:
+            save_dataset(key, df, store_dir)
+            stored = load_stored_dataset(key, store_dir)
+            if stored is not None:
+                df = stored
+        except (pa.ArrowException, OSError, ValueError, TypeError):
+            pass
+
+    if cache is not None:
+        cache.put(key, df)
+    return df
+
+
+def load_uploaded_file(uploaded_file, cache=None, store_dir=None):
+    """Загрузка файла с кэшированием результата разбора по хэшу содержимого
+
+    Для больших Excel файлов выбрасывает ParsePending, пока идет фоновый разбор.
+    """
+    key = uploaded_file_key(uploaded_file)
+
+    df = _lookup_dataset(key, cache, store_dir)
+    if df is None:
+        # Большие книги разбираются в фоне, пока интерфейс показывает прогресс
+        if (file_extension(uploaded_file.name) == 'xlsx'
+                and len(uploaded_file.getvalue()) >= BACKGROUND_PARSE_MIN_BYTES):
+            parsed = _parse_in_background(uploaded_file, key)
+        else:
+            parsed = read_uploaded_bytes(uploaded_file.getvalue(), uploaded_file.name)
+        df = _remember_dataset(key, optimize_dtypes(parsed), cache, store_dir)
+    return df
+
+
+def list_excel_sheets(data):
+    """Список листов книги Excel без разбора их содержимого"""
+    with pd.ExcelFile(io.BytesIO(data)) as workbook:
+        return list(workbook.sheet_names)
+
+
+def _process_pool(max_workers=None):
+    """Пул процессов для параллельной обработки
+
+    Рабочие функции лежат в модуле sales_workers, поэтому процессы
+    запускаются через forkserver (или spawn), а не fork многопоточного сервера.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['sales_workers'])
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def _run_in_pool(function, calls, max_workers, on_progress=None, cancel_event=None):
+    """Вызовы function(*args) в пуле процессов
+
+    Возвращает список результатов или None, если пул недоступен, сломался
+    или не уложился в POOL_TIMEOUT_SECONDS - тогда вызывающий считает сам.
+    on_progress получает число завершенных вызовов, при установленном
+    cancel_event невыполненные вызовы отменяются и выбрасывается ParseCancelled.
+    """
+    try:
+        pool = _process_pool(max_workers)
+    except (OSError, ValueError):
+        return None
+    deadline = time.monotonic() + POOL_TIMEOUT_SECONDS
+    try:
+        futures = [pool.submit(function, *args) for args in calls]
+        pending = set(futures)
+        while pending:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled("Загрузка файла отменена")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Пул процессов не уложился в отведенное время")
+            _, pending = wait_futures(pending, timeout=min(remaining, PROGRESS_POLL_SECONDS),
+                                      return_when=FIRST_COMPLETED)
+            if on_progress is not None:
+                on_progress(len(futures) - len(pending))
+        return [future.result() for future in futures]
+    except (BrokenProcessPool, TimeoutError, pickle.PicklingError, AttributeError, OSError):
+        return None
+    finally:
+        # Без ожидания: зависший процесс не должен блокировать сессию
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def read_excel_sheets(data, sheet_names, extension='xlsx', max_workers=None, progress=None,
+                      cancel_event=None):
+    """Параллельное чтение листов книги Excel в пуле процессов
+
+    В progress['sheets_done'] отмечается число прочитанных листов, установленный
+    cancel_event прерывает чтение исключением ParseCancelled.
+    """
+    def mark_done(count):
+        if progress is not None:
+            progress['sheets_done'] = count
+
+    if len(sheet_names) == 1:
+        frame = pd.read_excel(io.BytesIO(data), sheet_name=sheet_names[0])
+        mark_done(1)
+        return {sheet_names[0]: frame}
+
+    # Дочерние процессы читают книгу с диска, а не получают копию байтов каждый
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, f'workbook.{extension}')
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+        workers = min(len(sheet_names), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            frames = _run_in_pool(read_excel_sheet, [(path, name) for name in sheet_names],
+                                  workers, mark_done, cancel_event)
+            if frames is not None:
+                return dict(zip(sheet_names, frames))
+
+        # Последовательное чтение, если пул процессов недоступен
+        frames = {}
+        for name in sheet_names:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled("Загрузка файла отменена")
+            frames[name] = read_excel_sheet(path, name)
+            mark_done(len(frames))
+        return frames
+
+
+def load_excel_sheets(uploaded_file, sheet_names, cache=None, store_dir=None):
+    """Загрузка выбранных листов книги с параллельным разбором еще не загруженных"""
+    file_key = uploaded_file_key(uploaded_file)
+    keys = {name: file_content_hash(f'{file_key}:{name}'.encode('utf-8'))
+            for name in sheet_names}
+
+    frames = {name: _lookup_dataset(keys[name], cache, store_dir) for name in sheet_names}
+    missing = [name for name, df in frames.items() if df is None]
+    if missing:
+        data = uploaded_file.getvalue()
+        extension = file_extension(uploaded_file.name)
+        # Большие книги разбираются в фоне: листы - в пуле процессов, прогресс - по листам
+        if extension == 'xlsx' and len(data) >= BACKGROUND_PARSE_MIN_BYTES:
+            parsed = _parse_in_background(uploaded_file, f'{file_key}:sheets:{tuple(missing)}',
+                                          missing)
+        else:
+            parsed = read_excel_sheets(data, missing, extension)
+        for name, df in parsed.items():
+            frames[name] = _remember_dataset(keys[name], optimize_dtypes(df), cache, store_dir)
+    return frames
+
+
+def combine_sheets(frames):
+    """Объединение листов одинаковой структуры с суммированием продаж по периодам"""
+    combined = pd.concat(list(frames.values()), ignore_index=True)
+    date_position, _ = detect_date_column(combined)
+    if date_position is not None:
+        return combined.groupby(combined.columns[date_position], sort=True).sum().reset_index()
+    return combined
+
+
+def _period_codes(dates, freq):
+    """Целочисленные номера периодов для дат (месяцы, недели с понедельника или дни)"""
+    values = dates.to_numpy(dtype='datetime64[ns]')
+    if freq in ('M', 'Q', 'Y'):
+        return _coarser_codes(values.astype('datetime64[M]').astype(np.int64), 'M', freq)
+    return _coarser_codes(values.astype('datetime64[D]').astype(np.int64), 'D', freq)
+
+
+def _coarser_codes(codes, freq, target):
+    """Перевод номеров периодов в номера более крупных периодов"""
+    if freq == target:
+        return codes
+    if freq == 'D' and target == 'W':
+        # 1970-01-01 - четверг: сдвиг на 3 дня дает недели, начинающиеся с понедельника
+        return (codes + 3) // 7
+    if freq == 'D':
+        months = codes.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return _coarser_codes(months, 'M', target)
+    if freq == 'M':
+        return _coarser_codes(codes // 3, 'Q', target)
+    if freq == 'Q' and target == 'Y':
+        return codes // 4
+    raise ValueError(f"Нельзя перейти от периода {freq} к {target}")
+
+
+def _period_starts(codes, freq):
+    """Даты начала периодов по их целочисленным номерам"""
+    if freq in ('M', 'Q', 'Y'):
+        months = codes * {'M': 1, 'Q': 3, 'Y': 12}[freq]
+        return pd.DatetimeIndex(months.astype('datetime64[M]').astype('datetime64[ns]'))
+    days = codes * 7 - 3 if freq == 'W' else codes
+    return pd.DatetimeIndex(days.astype('datetime64[D]').astype('datetime64[ns]'))
+
+
+def pivot_long_sales(df, date_column, product_column, amount_column, freq='M'):
+    """Сведение транзакций (дата, продукт, сумма) в широкую таблицу по периодам"""
+    date_format = infer_date_format(df[date_column])
+    dates = parse_dates(df[date_column], date_format)
+    period_codes = _period_codes(dates, freq)
+
+    # Коды продуктов вместо строк: сумма считается одним bincount по парам кодов
+    product_codes, products = pd.factorize(df[product_column], sort=True)
+    amounts = pd.to_numeric(df[amount_column], errors='coerce').to_numpy(
+        dtype=np.float64, na_value=np.nan)
+
+    valid = (product_codes >= 0) & ~np.isnat(dates.to_numpy(dtype='datetime64[ns]'))
+    if not valid.any():
+        raise ValueError("Нет транзакций с корректной датой и продуктом")
+    period_codes, product_codes, amounts = period_codes[valid], product_codes[valid], amounts[valid]
 
-    # Обработка первого столбца как даты
-    if df.columns[0] == 'Unnamed: 0' or 'дата' in df.columns[0].lower():
-        df.iloc[:, 0] = pd.to_datetime(df.iloc[:, 0])
-        df = df.set_index(df.columns[0])
+    first_period = period_codes.min()
+    n_periods = int(period_codes.max() - first_period) + 1
+    n_products = len(products)
+    if n_periods * n_products > PIVOT_MAX_CELLS:
+        raise ValueError(f"Слишком большая таблица: {n_periods} периодов x {n_products} продуктов. "
+                         f"Выберите более крупный период")
 
-    # Базовая статистика
-    results['basic_stats'] = df.describe()
+    cells = (period_codes - first_period) * n_products + product_codes
+    totals = np.bincount(cells, weights=np.nan_to_num(amounts),
+                         minlength=n_periods * n_products).reshape(n_periods, n_products)
+    if pd.api.types.is_integer_dtype(df[amount_column].dtype):
+        totals = totals.astype(np.int64)
 
-    # Общие продажи по продуктам
-    results['total_sales_per_product'] = df.sum()
+    wide = pd.DataFrame(totals, columns=pd.Index(products).astype(str))
+    wide.insert(0, 'Дата', _period_starts(np.arange(n_periods) + first_period, freq))
+    return wide
 
-    # Общие ежемесячные продажи
-    results['total_monthly_sales'] = df.sum(axis=1)
 
-    # Средние ежемесячные продажи по продуктам
-    results['average_monthly_sales_per_product'] = df.mean()
+def _guess_long_columns(df):
+    """Предположение о столбцах даты, продукта и суммы в таблице транзакций"""
+    columns = list(df.columns)
+    date_position, _ = detect_date_column(df)
+    date_column = columns[date_position] if date_position is not None else columns[0]
 
-    # Месяц с наивысшими продажами
-    results['month_highest_sales'] = results['total_monthly_sales'].idxmax()
+    numeric = [c for c in columns if c != date_column
+               and pd.api.types.is_numeric_dtype(df[c].dtype)]
+    other = [c for c in columns if c != date_column and c not in numeric]
+    amount_column = numeric[-1] if numeric else columns[-1]
+    product_column = other[0] if other else next(c for c in columns if c != amount_column)
+    return date_column, product_column, amount_column
 
-    # Продукт с наивысшими общими продажами
+
+def select_long_format_options(df):
+    """Выбор столбцов таблицы транзакций и периода сведения в боковой панели"""
+    if df.shape[1] < 3:
+        raise ValueError("Для длинного формата нужны столбцы даты, продукта и суммы")
+
+    columns = list(df.columns)
+    date_guess, product_guess, amount_guess = _guess_long_columns(df)
+    date_column = st.sidebar.selectbox("Столбец даты", columns, index=columns.index(date_guess))
+    product_column = st.sidebar.selectbox("Столбец продукта", columns,
+                                          index=columns.index(product_guess))
+    amount_column = st.sidebar.selectbox("Столбец суммы", columns,
+                                         index=columns.index(amount_guess))
+    period = st.sidebar.selectbox("Период сведения", list(PIVOT_FREQUENCIES))
+    return date_column, product_column, amount_column, PIVOT_FREQUENCIES[period]
+
+
+def load_long_format_data(df, source_key, options, cache=None):
+    """Сведение таблицы транзакций в широкую таблицу с кэшированием результата"""
+    key = f'{source_key}:pivot:{options}'
+    wide = cache.get(key) if cache is not None else None
+    if wide is None:
+        wide = optimize_dtypes(pivot_long_sales(df, *options))
+        if cache is not None:
+            cache.put(key, wide)
+    return wide
+
+
+def select_workbook_sheets(uploaded_file, cache=None):
+    """Выбор листов книги и режима их обработки (None для книги с одним листом)"""
+    sheets_key = uploaded_file_key(uploaded_file) + ':sheets'
+    sheet_names = cache.get(sheets_key) if cache is not None else None
+    if sheet_names is None:
+        sheet_names = list_excel_sheets(uploaded_file.getvalue())
+        if cache is not None:
+            cache.put(sheets_key, sheet_names)
+
+    if len(sheet_names) == 1:
+        return None
+
+    selected = st.sidebar.multiselect("Листы для анализа", sheet_names, default=sheet_names)
+    if not selected:
+        raise ValueError("Не выбрано ни одного листа")
+    sheet_mode = st.sidebar.radio("Обработка листов", ["Объединить листы", "Анализ по листам"])
+    if sheet_mode == "Объединить листы":
+        return tuple(selected), None
+    return tuple(selected), st.sidebar.selectbox("Лист для анализа", selected)
+
+
+def load_wide_data(uploaded_file, cache=None, store_dir=None, sheet_options=None,
+                   long_options=None):
+    """Загрузка файла в широкую таблицу с учетом выбранных листов и формата данных"""
+    if sheet_options is None:
+        df = load_uploaded_file(uploaded_file, cache, store_dir)
+    else:
+        selected, sheet = sheet_options
+        frames = load_excel_sheets(uploaded_file, list(selected), cache, store_dir)
+        df = optimize_dtypes(combine_sheets(frames)) if sheet is None else frames[sheet]
+
+    if long_options is not None:
+        source_key = f'{uploaded_file_key(uploaded_file)}:{sheet_options}'
+        df = load_long_format_data(df, source_key, long_options, cache)
+    return df
+
+
+def append_dataset(existing, new, freq=None):
+    """Добавление строк к набору данных с удалением дублей по дате (остается новая строка)
+
+    Для сведенных транзакций (freq - период сведения) период может содержать
+    продажи из обоих файлов, поэтому совпадающие периоды складываются.
+    """
+    if existing is None:
+        return new
+    if freq is not None:
+        wide = existing.set_index('Дата').add(new.set_index('Дата'), fill_value=0)
+        return _fill_period_gaps(wide, freq)
+
+    combined = pd.concat([existing, new], ignore_index=True)
+    date_position, _ = detect_date_column(combined)
+    if date_position is None:
+        return combined
+
+    date_column = combined.columns[date_position]
+    combined = combined.drop_duplicates(subset=date_column, keep='last')
+    return combined.sort_values(date_column, kind='stable').reset_index(drop=True)
+
+
+def ingest_uploaded_files(uploaded_files, cache=None, store_dir=None, sheet_options=None,
+                          long_options=None):
+    """Инкрементальное добавление загруженных файлов к набору данных сессии
+
+    Вместе с набором хранится SalesAggregator: файлы с новыми периодами
+    учитываются в нем за O(новых строк), иначе агрегатор строится заново.
+    Состояние сессии сохраняется после каждого файла, поэтому ошибка или
+    фоновый разбор одного файла не теряют уже добавленные.
+    """
+    keys = [f'{uploaded_file_key(uploaded_file)}:{sheet_options}:{long_options}'
+            for uploaded_file in uploaded_files]
+    ingested = st.session_state.get('ingested_files')
+    data = st.session_state.get('uploaded_data')
+    aggregator = st.session_state.get('session_aggregator')
+
+    # Набор строится заново, если файл убрали из списка или изменились настройки
+    if not isinstance(ingested, list) or data is None or not set(ingested) <= set(keys):
+        ingested, data, aggregator = [], None, None
+
+    # Разбираются и добавляются только еще не учтенные файлы
+    for uploaded_file, key in zip(uploaded_files, keys):
+        if key in ingested:
+            continue
+        new_data = load_wide_data(uploaded_file, cache, store_dir, sheet_options, long_options)
+        extends = aggregator is not None and aggregator.follows(new_data)
+        previous_rows = 0 if data is None else len(data)
+        data = append_dataset(data, new_data,
+                              long_options[3] if long_options is not None else None)
+        # Строки, добавленные заполнением пропущенных периодов, агрегатор не видел
+        extends = extends and len(data) == previous_rows + len(new_data)
+        if extends:
+            # Сохраненный в сессии агрегатор не изменяется до сохранения набора
+            aggregator = aggregator.copy()
+            aggregator.append(new_data)
+        else:
+            try:
+                aggregator = SalesAggregator.from_frame(data)
+            except (ValueError, TypeError):
+                # Без агрегатора статистики считаются по всему набору
+                aggregator = None
+        ingested = ingested + [key]
+
+        st.session_state['uploaded_data'] = data
+        st.session_state['ingested_files'] = ingested
+        st.session_state['session_aggregator'] = aggregator
+    return data
+
+
+def top_k(series, k, largest=True):
+    """K наибольших (или наименьших) значений Series за O(n) частичным отбором
+
+    Пропуски не участвуют, порядок как у nlargest/nsmallest: по значению,
+    при равенстве - по позиции в исходном ряду.
+    """
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    positions = np.flatnonzero(~np.isnan(values))
+    keys = -values[positions] if largest else values[positions]
+    if 0 < k < positions.size:
+        selected = np.argpartition(keys, k - 1)[:k]
+        # Равные граничному значению берутся все, лишние отсекает сортировка по позиции
+        threshold = keys[selected].max()
+        selected = np.concatenate((selected[keys[selected] < threshold],
+                                   np.flatnonzero(keys == threshold)))
+        positions, keys = positions[selected], keys[selected]
+    order = np.lexsort((positions, keys))[:k]
+    return series.iloc[positions[order]]
+
+
+class StreamingTopK:
+    """Рейтинг K лучших элементов для данных, поступающих блоками
+
+    Элементы с окончательными значениями (например, итоги периодов) проходят
+    через кучу размера K: блок сначала сокращается частичным отбором, поэтому
+    учет стоит O(размер блока + K log K).
+    """
+
+    def __init__(self, k, largest=True):
+        self.k = k
+        self.largest = largest
+        self._heap = []
+        self._seen = 0
+
+    def push(self, labels, values):
+        """Учет блока меток и значений"""
+        block = top_k(pd.Series(np.asarray(values, dtype=np.float64)), self.k, self.largest)
+        sign = 1 if self.largest else -1
+        labels = list(labels)
+        for position, value in block.items():
+            # Ранние элементы выигрывают при равенстве, как в top_k
+            item = (sign * value, -(self._seen + position), labels[position])
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+        self._seen += len(labels)
+
+    def result(self):
+        """Отобранные элементы, упорядоченные от лучшего"""
+        items = sorted(self._heap, reverse=True)
+        sign = 1 if self.largest else -1
+        return pd.Series([sign * value for value, _, _ in items],
+                         index=[label for _, _, label in items], dtype=np.float64)
+
+
+class SalesAggregator:
+    """Накопление итогов по продуктам без хранения исходных строк
+
+    Суммы, среднее и дисперсия (Велфорд, слияние блоков по Чану), минимумы,
+    максимумы и лучший период обновляются за O(новых строк), поэтому
+    дописанные строки не требуют пересчета всего набора.
+    """
+
+    def __init__(self, columns, top_periods=TOP_K_MAX):
+        self.columns = list(columns)
+        n_products = len(self.columns)
+        self.n_rows = 0
+        self.counts = np.zeros(n_products, dtype=np.int64)
+        self.totals = np.zeros(n_products)
+        self.means = np.zeros(n_products)
+        self.m2 = np.zeros(n_products)
+        self.mins = np.full(n_products, np.inf)
+        self.maxs = np.full(n_products, -np.inf)
+        self.best_period = None
+        self.best_period_total = -np.inf
+        self.top_periods = StreamingTopK(top_periods)
+        self.sketch = QuantileSketch(n_products)
+        self.date_column = None
+        self.date_format = None
+        self.last_period = None
+        self.in_order = True
+        self._layout_known = False
+        self._period_labels = []
+        self._period_totals = []
+        self._results = None
+
+    @property
+    def nbytes(self):
+        """Память, занятая накопленными данными: массивы по продуктам и по периодам"""
+        blocks = self._period_labels + self._period_totals + self.sketch.levels
+        per_product = (self.counts, self.totals, self.means, self.m2, self.mins, self.maxs)
+        return sum(array.nbytes for array in blocks) + sum(array.nbytes for array in per_product)
+
+    @property
+    def missing_values(self):
+        """Количество пропущенных значений в учтенных строках"""
+        return int(self.n_rows * len(self.columns) - self.counts.sum())
+
+    def update(self, labels, values):
+        """Учет блока строк: метки периодов и матрица (строки x продукты)"""
+        values = np.asarray(values, dtype=float).reshape(-1, len(self.columns))
+        if values.shape[0] == 0:
+            return
+
+        self.sketch.update(values)
+        present = ~np.isnan(values)
+        block_counts = present.sum(axis=0)
+        block_totals = np.nansum(values, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block_means = np.where(block_counts > 0, block_totals / block_counts, 0.0)
+            block_m2 = np.where(present, values - block_means, 0.0)
+            block_m2 = (block_m2 * block_m2).sum(axis=0)
+
+            # Слияние моментов накопленной части и нового блока
+            counts = self.counts + block_counts
+            delta = block_means - self.means
+            share = np.where(counts > 0, block_counts / counts, 0.0)
+            self.means = self.means + delta * share
+            self.m2 = self.m2 + block_m2 + delta * delta * self.counts * share
+        self.counts = counts
+
+        self.n_rows += values.shape[0]
+        self.totals += block_totals
+        # fmin/fmax игнорируют NaN без предупреждений для пустых столбцов
+        self.mins = np.fmin(self.mins, np.fmin.reduce(values, axis=0))
+        self.maxs = np.fmax(self.maxs, np.fmax.reduce(values, axis=0))
+
+        # Метки блока хранятся массивом datetime64 или int64, а не объектами на строку
+        labels = np.asarray(labels)
+        # Порядок периодов нужен, чтобы дописанные строки совпадали с отсортированным набором
+        if self.in_order:
+            try:
+                index = pd.Index(labels)
+                self.in_order = bool(index.is_monotonic_increasing
+                                     and (self.last_period is None
+                                          or index[0] > self.last_period))
+            except TypeError:
+                self.in_order = False
+        self.last_period = labels[-1]
+
+        period_totals = np.nansum(values, axis=1)
+        best = int(np.argmax(period_totals))
+        if period_totals[best] > self.best_period_total:
+            self.best_period, self.best_period_total = labels[best], period_totals[best]
+        self.top_periods.push(labels, period_totals)
+
+        self._period_labels.append(labels)
+        self._period_totals.append(period_totals)
+        self._results = None
+
+    def append(self, df):
+        """Учет новых строк DataFrame в формате analyze_sales_data
+
+        Столбец дат и его формат определяются по первому блоку и
+        используются для всех следующих.
+        """
+        if not self._layout_known:
+            date_position, self.date_format = detect_date_column(df)
+            self.date_column = df.columns[date_position] if date_position is not None else None
+            self._layout_known = True
+
+        if self.date_column is not None:
+            labels = parse_dates(df[self.date_column], self.date_format)
+        else:
+            labels = range(self.n_rows, self.n_rows + len(df))
+
+        missing = [column for column in self.columns if column not in df.columns]
+        if missing:
+            raise ValueError(f"В новых строках нет столбцов: {', '.join(map(str, missing))}")
+        self.update(labels, df[self.columns].to_numpy(dtype=np.float64, na_value=np.nan))
+
+    def follows(self, df):
+        """Можно ли учесть строки df дописыванием: те же продукты и только новые периоды"""
+        if not self.in_order or self.n_rows == 0:
+            return False
+        date_position, _ = detect_date_column(df)
+        columns = [column for i, column in enumerate(df.columns)
+                   if i != date_position and pd.api.types.is_numeric_dtype(df.iloc[:, i])]
+        if columns != self.columns:
+            return False
+        if self.date_column is None:
+            return date_position is None
+        if df.columns[date_position] != self.date_column:
+            return False
+
+        try:
+            labels = pd.Index(parse_dates(df[self.date_column], self.date_format))
+            return bool(len(labels) and labels.is_monotonic_increasing
+                        and labels[0] > self.last_period)
+        except (ValueError, TypeError):
+            return False
+
+    def copy(self):
+        """Копия для дописывания строк без изменения исходного агрегатора
+
+        Массивы по продуктам, рейтинг и эскиз копируются, блоки периодов
+        не изменяются после учета и разделяются с исходным агрегатором.
+        """
+        clone = copy.copy(self)
+        clone.totals = self.totals.copy()
+        clone.top_periods = copy.deepcopy(self.top_periods)
+        clone.sketch = copy.deepcopy(self.sketch)
+        clone._period_labels = list(self._period_labels)
+        clone._period_totals = list(self._period_totals)
+        return clone
+
+    @classmethod
+    def from_frame(cls, df):
+        """Агрегатор по всем числовым столбцам DataFrame"""
+        date_position, _ = detect_date_column(df)
+        columns = [column for i, column in enumerate(df.columns)
+                   if i != date_position and pd.api.types.is_numeric_dtype(df.iloc[:, i])]
+        aggregator = cls(columns)
+        aggregator.append(df)
+        return aggregator
+
+    def statistics(self):
+        """Статистики, суммы по продуктам и по периодам в формате compute_sales_statistics
+
+        Квартили оцениваются эскизом, граница ошибки ранга - в stats['rank_error'].
+        """
+        has_values = self.counts > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stds = np.sqrt(self.m2 / (self.counts - 1))
+        quartiles = self.sketch.quantiles(QUARTILES)
+        stats = {
+            'count': self.counts.astype(float),
+            'mean': np.where(has_values, self.means, np.nan),
+            'std': np.where(self.counts > 1, stds, np.nan),
+            'min': np.where(has_values, self.mins, np.nan),
+            '25%': quartiles[0],
+            '50%': quartiles[1],
+            '75%': quartiles[2],
+            'max': np.where(has_values, self.maxs, np.nan),
+            'rank_error': self.sketch.error_bound(),
+        }
+        return stats, self.totals, np.concatenate(self._period_totals)
+
+    def results(self):
+        """Формирование словаря результатов в формате analyze_sales_data"""
+        if self.n_rows == 0:
+            raise ValueError("Нет данных для анализа")
+        if self._results is not None:
+            return self._results
+
+        stats, totals, period_totals = self.statistics()
+        labels = np.concatenate(self._period_labels)
+        if np.issubdtype(labels.dtype, np.datetime64):
+            period_index = pd.DatetimeIndex(labels)
+            best_period = pd.Timestamp(self.best_period)
+        else:
+            period_index = pd.Index(labels)
+            best_period = self.best_period
+
+        self._results = _results_from_aggregates(
+            self.columns, stats, totals, pd.Series(period_totals, index=period_index),
+            best_period=best_period
+        )
+        self._results['top_periods'] = self.top_periods.result()
+        # Квартили приближенные: граница ошибки ранга в таблице статистики
+        self._results['basic_stats'].loc['rank_error'] = stats['rank_error']
+        return self._results
+
+
+def _results_from_aggregates(columns, stats, totals, monthly_totals, best_period=None):
+    """Сборка словаря результатов анализа из рассчитанных агрегатов"""
+    results = {}
+    results['basic_stats'] = pd.DataFrame(np.vstack([stats[name] for name in DESCRIBE_INDEX]),
+                                          index=DESCRIBE_INDEX, columns=columns)
+    results['total_sales_per_product'] = pd.Series(totals, index=columns)
+    results['total_monthly_sales'] = monthly_totals
+    results['average_monthly_sales_per_product'] = pd.Series(stats['mean'], index=columns)
+    results['month_highest_sales'] = (best_period if best_period is not None
+                                      else results['total_monthly_sales'].idxmax())
     results['product_highest_sales'] = results['total_sales_per_product'].idxmax()
+    return results
+
+
+def _is_date_column_name(name):
+    """Проверка, указывает ли название столбца на столбец с датами"""
+    return name == 'Unnamed: 0' or 'дата' in str(name).lower()
+
+
+def _has_date_name_hint(name):
+    """Проверка, начинается ли название столбца со слова, связанного с датами"""
+    words = re.findall(r'\w+', str(name).lower())
+    return bool(words) and words[0] in DATE_NAME_HINTS
+
+
+def _sample_values(series, sample_size=DATE_SAMPLE_SIZE):
+    """Равномерная выборка непустых значений столбца"""
+    values = series.dropna()
+    if len(values) > sample_size:
+        values = values.iloc[np.linspace(0, len(values) - 1, sample_size).astype(int)]
+    return values
+
+
+def infer_date_format(series, sample_size=DATE_SAMPLE_SIZE):
+    """Определение формата дат по выборке значений (None, если столбец не похож на даты)"""
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if isinstance(dtype, pd.ArrowDtype) and (pa.types.is_date(dtype.pyarrow_dtype)
+                                             or pa.types.is_timestamp(dtype.pyarrow_dtype)):
+        return 'datetime'
+
+    # Порядковые номера дат Excel принимаются только для столбцов с «датным» названием:
+    # целые неубывающие числа из допустимого диапазона
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        if not _has_date_name_hint(series.name):
+            return None
+        sample = _sample_values(series, sample_size).astype(float)
+        low, high = EXCEL_SERIAL_RANGE
+        if (not sample.empty and sample.between(low, high).all()
+                and (sample % 1 == 0).all() and sample.is_monotonic_increasing):
+            return 'excel'
+        return None
+
+    sample = _sample_values(series, sample_size)
+    if sample.empty:
+        return None
+
+    if pd.api.types.infer_dtype(sample, skipna=True) in ('datetime', 'datetime64', 'date'):
+        return 'datetime'
+    if pd.api.types.infer_dtype(sample, skipna=True) != 'string':
+        return None
+
+    text = sample.astype(str).str.strip()
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(text, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def detect_date_column(df, sample_size=DATE_SAMPLE_SIZE):
+    """Поиск столбца с датами: позиция столбца и формат (или None, None)"""
+    for position in range(df.shape[1]):
+        date_format = infer_date_format(df.iloc[:, position], sample_size)
+        if date_format is not None:
+            return position, date_format
+
+    # Первый столбец с «датным» названием разбирается без заданного формата
+    if df.shape[1] > 0 and _is_date_column_name(df.columns[0]):
+        return 0, None
+    return None, None
+
+
+def parse_dates(series, date_format):
+    """Векторизованный разбор столбца дат по определенному заранее формату"""
+    if date_format == 'datetime':
+        return pd.to_datetime(series)
+    if date_format == 'excel':
+        return pd.to_datetime(series.astype(float), unit='D', origin='1899-12-30')
+    if date_format is None:
+        return pd.to_datetime(series)
+
+    text = series.astype(str).str.strip()
+    try:
+        # Разбор day-first дат со временем через strptime медленный:
+        # перестановка в ISO 8601 позволяет использовать быстрый разборщик
+        if date_format.startswith(('%d.%m.%Y', '%d/%m/%Y')) and '%H' in date_format:
+            iso_text = text.str.replace(r'^(\d{2})[./](\d{2})[./](\d{4})', r'\3-\2-\1', regex=True)
+            return pd.to_datetime(iso_text, format='ISO8601')
+        return pd.to_datetime(text, format=date_format)
+    except ValueError:
+        # Формат определен по выборке: редкие значения в другом формате
+        return pd.to_datetime(text, format='mixed', dayfirst=True)
+
+
+def _sheet_columns(header):
+    """Названия столбцов по строке заголовка листа, как у pd.read_excel
+
+    Исходные значения заголовка сохраняются, пустые становятся 'Unnamed: i',
+    повторы получают суффиксы .1, .2, ... в обход уже занятых названий.
+    """
+    if header is None:
+        raise ValueError("Лист не содержит данных")
+    columns = [f'Unnamed: {i}' if name is None else name for i, name in enumerate(header)]
+    counts = {}
+    for i, name in enumerate(columns):
+        count = counts.get(name, 0)
+        renamed = name
+        while count > 0:
+            counts[name] = count + 1
+            renamed = f'{name}.{count}'
+            count = count + 1 if renamed in columns else counts.get(renamed, 0)
+        columns[i] = renamed
+        counts[renamed] = count + 1
+    return columns
+
+
+def _normalized_rows(rows, width):
+    """Строки листа, дополненные или обрезанные до ширины заголовка
+
+    Пустые строки внутри данных сохраняются (значения NaN, как у pd.read_excel),
+    пустые строки в конце листа отбрасываются.
+    """
+    blank_rows = 0
+    for row in rows:
+        row = tuple(row[:width]) + (None,) * (width - len(row))
+        if all(value is None for value in row):
+            blank_rows += 1
+            continue
+        for _ in range(blank_rows):
+            yield (None,) * width
+        blank_rows = 0
+        yield row
+
+
+def iter_dataset_chunks(source, extension, chunk_rows=CHUNK_ROWS, sheet_name=None):
+    """Чтение файла порциями DataFrame без загрузки всей таблицы в память
+
+    CSV читается блоками pyarrow, Parquet - пакетами строк, Feather - пакетами
+    записей Arrow, Excel (xlsx) - строками в режиме read-only.
+    """
+    if extension == 'csv':
+        read_options = pa_csv.ReadOptions(block_size=CSV_CHUNK_BYTES)
+        reader = pa_csv.open_csv(source, read_options=read_options)
+        # Типы выводятся по первому блоку: целые столбцы читаются как float64,
+        # чтобы дробные значения в следующих блоках не прерывали чтение
+        widened = {field.name: pa.float64() for field in reader.schema
+                   if pa.types.is_integer(field.type)}
+        if widened:
+            reader.close()
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            reader = pa_csv.open_csv(source, read_options=read_options,
+                                     convert_options=pa_csv.ConvertOptions(column_types=widened))
+        for batch in reader:
+            yield batch.to_pandas(types_mapper=pd.ArrowDtype)
+    elif extension == 'parquet':
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas(types_mapper=pd.ArrowDtype)
+    elif extension == 'feather':
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for start in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(start, chunk_rows).to_pandas(types_mapper=pd.ArrowDtype)
+    elif extension == 'xlsx':
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        with closing(workbook):
+            sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+            rows = sheet.iter_rows(values_only=True)
+            columns = _sheet_columns(next(rows, None))
+            block = []
+            for row in _normalized_rows(rows, len(columns)):
+                block.append(row)
+                if len(block) >= chunk_rows:
+                    yield pd.DataFrame(block, columns=columns)
+                    block = []
+            if block:
+                yield pd.DataFrame(block, columns=columns)
+    else:
+        raise ValueError(f"Чтение порциями не поддерживается для файлов .{extension}")
+
+
+def _local_sales_statistics(values, quantiles, approximate):
+    """Статистики матрицы в текущем процессе: точные или с квартилями по эскизу"""
+    if approximate:
+        return sketch_sales_statistics(values)
+    return compute_sales_statistics(values, quantiles)
+
+
+def parallel_sales_statistics(values, quantiles=True, max_workers=None, approximate=False):
+    """compute_sales_statistics по блокам столбцов в пуле процессов
+
+    Матрица один раз копируется в общую память в порядке Fortran, так что
+    каждый блок продуктов - непрерывный участок, который процесс читает без
+    сериализации. Результаты блоков склеиваются, суммы по периодам складываются.
+    При approximate=True каждый процесс строит квантильный эскиз своих столбцов
+    (sketch_sales_statistics), эскизы столбцов независимы и тоже склеиваются.
+    Для небольших таблиц, а также если пул недоступен или не уложился
+    в POOL_TIMEOUT_SECONDS, расчет идет в текущем процессе.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_products = values.shape
+    workers = min(max_workers or os.cpu_count() or 1, n_products // PARALLEL_MIN_COLUMNS or 1)
+    if workers < 2 or values.size < PARALLEL_MIN_CELLS:
+        return _local_sales_statistics(values, quantiles, approximate)
+
+    memory = shared_memory.SharedMemory(create=True, size=values.nbytes)
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=memory.buf, order='F')[:] = values
+        bounds = np.linspace(0, n_products, workers + 1).astype(int)
+        parts = _run_in_pool(column_block_statistics,
+                             [(memory.name, values.shape, start, stop, quantiles, approximate)
+                              for start, stop in zip(bounds[:-1], bounds[1:])], workers)
+    except OSError:
+        parts = None
+    finally:
+        memory.close()
+        memory.unlink()
+    if parts is None:
+        # Последовательный расчет, если пул процессов недоступен
+        return _local_sales_statistics(values, quantiles, approximate)
+
+    stats = {name: np.concatenate([part[0][name] for part in parts]) for name in parts[0][0]}
+    totals = np.concatenate([part[1] for part in parts])
+    row_totals = np.sum([part[2] for part in parts], axis=0)
+    return stats, totals, row_totals
+
+
+def analyze_sales_chunks(chunks):
+    """Анализ широкой таблицы по порциям: итоги и моменты копятся в SalesAggregator"""
+    aggregator, preview = None, None
+    for chunk in chunks:
+        if aggregator is None:
+            aggregator = SalesAggregator.from_frame(chunk)
+            preview = chunk.head(5)
+        else:
+            aggregator.append(chunk)
+
+    if aggregator is None:
+        raise ValueError("Файл не содержит данных")
+    return aggregator, preview
+
+
+def pivot_long_chunks(chunks, date_column, product_column, amount_column, freq='M'):
+    """Сведение транзакций по порциям: частичные суммы периодов складываются"""
+    wide = None
+    for chunk in chunks:
+        part = pivot_long_sales(chunk, date_column, product_column, amount_column,
+                                freq).set_index('Дата')
+        wide = part if wide is None else wide.add(part, fill_value=0)
+        if wide.size > PIVOT_MAX_CELLS:
+            raise ValueError(f"Слишком большая таблица: {wide.shape[0]} периодов x "
+                             f"{wide.shape[1]} продуктов. Выберите более крупный период")
+
+    if wide is None:
+        raise ValueError("Файл не содержит данных")
+    return _fill_period_gaps(wide, freq)
+
+
+def _fill_period_gaps(wide, freq):
+    """Сводная таблица с индексом периодов без пропусков в формате pivot_long_sales"""
+    # Периоды без транзакций во всех частях - нулевые строки, как в pivot_long_sales
+    codes = _period_codes(wide.index, freq)
+    periods = _period_starts(np.arange(codes.min(), codes.max() + 1), freq)
+    wide = wide.reindex(periods, fill_value=0).sort_index(axis=1)
+    return wide.rename_axis('Дата').reset_index()
+
+
+class ParseCancelled(Exception):
+    """Разбор файла отменен пользователем"""
+
+
+class ParsePending(Exception):
+    """Файл еще разбирается в фоновом потоке"""
+
+    def __init__(self, job):
+        super().__init__("Файл еще загружается")
+        self.job = job
+
+
+def read_excel_rows(data, progress=None, cancel_event=None, sheet_name=None):
+    """Построчное чтение листа Excel в DataFrame с отчетом о прогрессе и отменой"""
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    with closing(workbook):
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+        if progress is not None:
+            progress['sheet'] = sheet.title
+            progress['rows'] = 0
+            progress['total_rows'] = max((sheet.max_row or 1) - 1, 0)
+
+        rows = sheet.iter_rows(values_only=True)
+        columns = _sheet_columns(next(rows, None))
+        records = []
+        for row in _normalized_rows(rows, len(columns)):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled("Загрузка файла отменена")
+            records.append(row)
+            if progress is not None and len(records) % PROGRESS_ROWS_STEP == 0:
+                progress['rows'] = len(records)
 
-    return results, df
+    if progress is not None:
+        progress['rows'] = len(records)
+    return pd.DataFrame(records, columns=columns)
 
 
-def create_visualizations(df, results):
-    """Создание визуализаций"""
+class ParseJob:
+    """Фоновый разбор файла в отдельном потоке с прогрессом и возможностью отмены
 
-    # График общих ежемесячных продаж
+    Без sheet_names читается первый лист и результат - DataFrame, иначе
+    листы читаются параллельно в пуле процессов (read_excel_sheets) и
+    результат - словарь {лист: DataFrame}, а прогресс считается по листам.
+    """
+
+    def __init__(self, data, sheet_names=None):
+        self.progress = {'sheet': '', 'rows': 0, 'total_rows': 0,
+                         'sheets_done': 0, 'sheet_count': len(sheet_names or [None])}
+        self.result = None
+        self.error = None
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(data, sheet_names), daemon=True)
+        self._thread.start()
+
+    def _run(self, data, sheet_names):
+        try:
+            if sheet_names is None:
+                self.result = read_excel_rows(data, self.progress, self._cancel_event)
+            else:
+                self.result = read_excel_sheets(data, list(sheet_names), progress=self.progress,
+                                                cancel_event=self._cancel_event)
+        except Exception as e:
+            self.error = e
+
+    @property
+    def done(self):
+        """Завершен ли разбор (успешно, с ошибкой или отменой)"""
+        return not self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        """Была ли запрошена отмена"""
+        return self._cancel_event.is_set()
+
+    @property
+    def fraction(self):
+        """Доля прочитанных строк с учетом уже прочитанных листов"""
+        progress = self.progress
+        total = progress['total_rows']
+        sheet_fraction = min(progress['rows'] / total, 1.0) if total else 0.0
+        return min((progress['sheets_done'] + sheet_fraction) / progress['sheet_count'], 1.0)
+
+    def cancel(self):
+        """Запрос отмены разбора"""
+        self._cancel_event.set()
+
+    def wait(self, timeout=None):
+        """Ожидание завершения разбора"""
+        self._thread.join(timeout)
+
+
+def _parse_in_background(uploaded_file, key, sheet_names=None):
+    """Разбор большого файла в фоновом потоке: результат или исключение ParsePending
+
+    Ключ задания начинается с хэша файла, по нему prune_parse_jobs находит
+    задания убранных из списка файлов.
+    """
+    jobs = st.session_state.get('parse_jobs')
+    if not isinstance(jobs, dict):
+        jobs = {}
+        st.session_state['parse_jobs'] = jobs
+
+    job = jobs.get(key)
+    if job is None:
+        # Задания того же файла для прежнего выбора листов больше не нужны
+        file_key = key.split(':', 1)[0]
+        for stale in [other for other in jobs if other.split(':', 1)[0] == file_key]:
+            jobs.pop(stale).cancel()
+        job = jobs[key] = ParseJob(uploaded_file.getvalue(), sheet_names)
+    if not job.done:
+        raise ParsePending(job)
+
+    # Отмененное задание остается, пока файл в списке, чтобы разбор не запускался снова;
+    # после ошибки задание удаляется, а результат передается в кэш вызывающим
+    if isinstance(job.error, ParseCancelled):
+        raise job.error
+    del jobs[key]
+    if job.error is not None:
+        raise job.error
+    return job.result
+
+
+def prune_parse_jobs(uploaded_files):
+    """Отмена и удаление фоновых заданий для файлов, убранных из списка"""
+    jobs = st.session_state.get('parse_jobs')
+    if not isinstance(jobs, dict) or not jobs:
+        return
+    file_keys = {uploaded_file_key(uploaded_file) for uploaded_file in uploaded_files}
+    for key in [key for key in jobs if key.split(':', 1)[0] not in file_keys]:
+        jobs.pop(key).cancel()
+
+
+def load_streamed_analysis(uploaded_file, cache=None):
+    """Потоковый анализ загруженного файла с кэшированием по хэшу содержимого"""
+    key = uploaded_file_key(uploaded_file) + ':stream'
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    # Excel читается порциями через openpyxl read-only, как и остальные форматы,
+    # поэтому столбец дат и его формат определяются одинаково для всех файлов
+    aggregator, preview = analyze_sales_chunks(iter_dataset_chunks(
+        io.BytesIO(uploaded_file.getvalue()), file_extension(uploaded_file.name)))
+    if cache is not None:
+        cache.put(key, (aggregator, preview),
+                  size=estimate_size(preview) + aggregator.nbytes)
+    return aggregator, preview
+
+
+def load_streamed_long_data(uploaded_file, cache=None):
+    """Сведение таблицы транзакций, прочитанной порциями, с выбором столбцов"""
+    extension = file_extension(uploaded_file.name)
+    first_chunk = next(iter_dataset_chunks(io.BytesIO(uploaded_file.getvalue()), extension,
+                                           chunk_rows=DATE_SAMPLE_SIZE), None)
+    if first_chunk is None:
+        raise ValueError("Файл не содержит данных")
+    options = select_long_format_options(first_chunk)
+
+    key = f'{uploaded_file_key(uploaded_file)}:stream:pivot:{options}'
+    wide = cache.get(key) if cache is not None else None
+    if wide is None:
+        wide = optimize_dtypes(pivot_long_chunks(
+            iter_dataset_chunks(io.BytesIO(uploaded_file.getvalue()), extension), *options))
+        if cache is not None:
+            cache.put(key, wide)
+    return wide
+
+
+def dataset_fingerprint(df):
+    """Отпечаток содержимого DataFrame (значения, индекс и названия столбцов)"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compute_correlation_matrix(df, cache=None, fingerprint=None):
+    """Корреляционная матрица продуктов, вычисляемая один раз на версию данных"""
+    key = None
+    if cache is not None:
+        key = (fingerprint or dataset_fingerprint(df)) + ':corr'
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    if np.isnan(values).any():
+        # Попарное исключение пропусков, как в DataFrame.corr()
+        correlation = df.corr()
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            matrix = np.corrcoef(values, rowvar=False) if values.shape[0] > 1 \
+                else np.full((values.shape[1],) * 2, np.nan)
+        correlation = pd.DataFrame(np.atleast_2d(matrix), index=df.columns, columns=df.columns)
+
+    if key is not None:
+        cache.put(key, correlation)
+    return correlation
+
+
+def correlation_order(correlation_matrix):
+    """Порядок продуктов, при котором сильно связанные оказываются рядом
+
+    Жадная цепочка ближайших соседей по |корреляции|: начиная с наименее
+    связанного продукта, следующим берется самый связанный с текущим из еще
+    не выбранных. Группы похожих продуктов собираются в блоки вдоль диагонали.
+    """
+    similarity = np.abs(np.nan_to_num(correlation_matrix.to_numpy(dtype=np.float64)))
+    n_products = len(similarity)
+    if n_products < 3:
+        return np.arange(n_products)
+
+    order = np.empty(n_products, dtype=np.int64)
+    current = int(np.argmin(similarity.sum(axis=1)))
+    available = np.ones(n_products, dtype=bool)
+    for position in range(n_products):
+        order[position] = current
+        available[current] = False
+        if position + 1 < n_products:
+            current = int(np.argmax(np.where(available, similarity[current], -1.0)))
+    return order
+
+
+def top_correlated_pairs(correlation_matrix, k=CORRELATION_TOP_PAIRS):
+    """Пары разных продуктов с наибольшей по модулю корреляцией"""
+    values = correlation_matrix.to_numpy(dtype=np.float64)
+    rows, columns = np.triu_indices_from(values, k=1)
+    pairs = pd.Series(np.abs(values[rows, columns]))
+    selected = top_k(pairs, k).index.to_numpy()
+    names = correlation_matrix.columns
+    return pd.DataFrame({
+        'Продукт 1': names[rows[selected]],
+        'Продукт 2': names[columns[selected]],
+        'Корреляция': values[rows[selected], columns[selected]],
+    })
+
+
+def max_pairwise_correlation(correlation_matrix):
+    """Наибольший коэффициент корреляции между разными продуктами"""
+    values = correlation_matrix.to_numpy()
+    pairs = values[np.triu_indices_from(values, k=1)]
+    pairs = pairs[~np.isnan(pairs)]
+    return pairs.max() if pairs.size else None
+
+
+def _reduce_sorted(codes, values):
+    """Суммы строк с одинаковыми номерами периодов (номера отсортированы)"""
+    if codes.size == 0:
+        return codes, values
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+    return codes[starts], np.add.reduceat(values, starts, axis=0)
+
+
+def _as_matrix(df):
+    """Значения DataFrame как матрица float64 с NaN вместо пропусков"""
+    return df.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _frame_like(df, values):
+    """DataFrame с индексом и столбцами df и новыми значениями"""
+    return pd.DataFrame(values, index=df.index, columns=df.columns)
+
+
+def rolling_mean(values, window):
+    """Скользящее среднее по строкам сразу для всех столбцов
+
+    Первые window - 1 строк и окна с пропусками дают NaN, как rolling(window).mean().
+    """
+    result = np.full(values.shape, np.nan)
+    if values.shape[0] >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+        result[window - 1:] = windows.mean(axis=-1)
+    return result
+
+
+def period_growth(values, lag):
+    """Относительный рост к значению lag периодов назад (0.1 - рост на 10%)"""
+    result = np.full(values.shape, np.nan)
+    if values.shape[0] > lag:
+        previous = values[:-lag]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[lag:] = np.where(previous != 0, values[lag:] / previous - 1, np.nan)
+    return result
+
+
+def trend_slopes(values):
+    """Наклоны линейной регрессии по номеру периода для всех столбцов сразу"""
+    present = ~np.isnan(values)
+    x = np.arange(values.shape[0], dtype=np.float64)[:, np.newaxis]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        counts = present.sum(axis=0)
+        x_mean = np.where(present, x, 0.0).sum(axis=0) / counts
+        y_mean = np.where(present, values, 0.0).sum(axis=0) / counts
+        x_centered = np.where(present, x - x_mean, 0.0)
+        covariance = (x_centered * np.where(present, values - y_mean, 0.0)).sum(axis=0)
+        variance = (x_centered * x_centered).sum(axis=0)
+        return np.where(variance > 0, covariance / variance, np.nan)
+
+
+class TimeRollupCube:
+    """Сводки продаж по дням, неделям, месяцам, кварталам и годам
+
+    Из исходных строк строится только дневной уровень, остальные уровни
+    суммируются из ближайшего более мелкого (ROLLUP_SOURCES) при первом
+    обращении и запоминаются, поэтому смена детализации не трогает исходные данные.
+    """
+
+    def __init__(self, df):
+        self.columns = df.columns
+        dates = df.index
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+        if dates.hasnans:
+            values, dates = values[~dates.isna()], dates[~dates.isna()]
+
+        codes = _period_codes(dates, 'D')
+        order = np.argsort(codes, kind='stable')
+        # Пропуски не влияют на суммы, как в DataFrame.sum()
+        self._levels = {'D': _reduce_sorted(codes[order], np.nan_to_num(values[order]))}
+
+    def level(self, freq):
+        """Номера периодов и матрица сумм (периоды x продукты) для уровня"""
+        if freq not in self._levels:
+            source = ROLLUP_SOURCES[freq]
+            codes, sums = self.level(source)
+            self._levels[freq] = _reduce_sorted(_coarser_codes(codes, source, freq), sums)
+        return self._levels[freq]
+
+    def frame(self, freq):
+        """Продажи по продуктам за периоды уровня"""
+        codes, sums = self.level(freq)
+        return pd.DataFrame(sums, index=_period_starts(codes, freq), columns=self.columns)
+
+    def totals(self, freq):
+        """Общие продажи за периоды уровня"""
+        codes, sums = self.level(freq)
+        return pd.Series(sums.sum(axis=1), index=_period_starts(codes, freq))
+
+
+# Реестр метрик анализа: имя -> (зависимости, функция расчета)
+METRICS = {}
+
+
+def register_metric(name, *dependencies):
+    """Декоратор регистрации метрики, вычисляемой по требованию
+
+    Функция метрики получает объект LazyResults и значения зависимостей
+    в порядке их объявления. Имена с подчеркиванием - служебные
+    промежуточные результаты, они не показываются среди ключей.
+    """
+    def decorator(function):
+        METRICS[name] = (dependencies, function)
+        return function
+    return decorator
+
+
+class LazyResults(Mapping):
+    """Результаты анализа, вычисляемые при первом обращении к метрике"""
+
+    def __init__(self, df, cache=None, metrics=None, approximate=False, aggregator=None):
+        self.df = df
+        self.cache = cache
+        self.approximate = approximate
+        self.aggregator = aggregator
+        self._metrics = METRICS if metrics is None else metrics
+        self._values = {}
+
+    def __getitem__(self, name):
+        if name in self._values:
+            return self._values[name]
+        if name not in self._metrics:
+            raise KeyError(name)
+
+        dependencies, function = self._metrics[name]
+        value = function(self, *(self[dependency] for dependency in dependencies))
+        self._values[name] = value
+        return value
+
+    def __iter__(self):
+        return (name for name in self._metrics if not name.startswith('_'))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, name):
+        return name in self._metrics and not name.startswith('_')
+
+    @property
+    def computed(self):
+        """Имена уже вычисленных метрик"""
+        return set(self._values)
+
+
+@register_metric('_statistics')
+def _statistics_metric(results):
+    """Базовая статистика, суммы по продуктам и по периодам одним расчетом"""
+    df = results.df
+    aggregator = results.aggregator
+    # Агрегатор сессии уже учел все строки: моменты и суммы берутся из него
+    if (aggregator is not None and aggregator.n_rows == len(df)
+            and aggregator.columns == list(df.columns)):
+        stats, totals, row_totals = aggregator.statistics()
+        stats = dict(stats)
+        if not results.approximate:
+            # Точные квартили требуют всех значений, эскиз - только в приближенном режиме
+            del stats['rank_error']
+            values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                stats['25%'], stats['50%'], stats['75%'] = np.nanquantile(values, QUARTILES,
+                                                                          axis=0)
+        return stats, totals, row_totals
+
+    # Приближенные квартили: один проход эскизом в каждом процессе пула
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    stats, totals, row_totals = parallel_sales_statistics(values,
+                                                          quantiles=not results.approximate,
+                                                          approximate=results.approximate)
+
+    # Целочисленные суммы считаются точно, как в DataFrame.sum()
+    if df.shape[1] and all(pd.api.types.is_integer_dtype(dtype) for dtype in df.dtypes) \
+            and not df.isna().any().any():
+        integers = df.to_numpy(dtype=np.int64)
+        totals, row_totals = integers.sum(axis=0), integers.sum(axis=1)
+    return stats, totals, row_totals
+
+
+@register_metric('basic_stats', '_statistics')
+def _basic_stats_metric(results, statistics):
+    """Описательная статистика в формате DataFrame.describe()"""
+    stats = statistics[0]
+    index = DESCRIBE_INDEX + (['rank_error'] if 'rank_error' in stats else [])
+    return pd.DataFrame(np.vstack([stats[name] for name in index]),
+                        index=index, columns=results.df.columns)
+
+
+@register_metric('total_sales_per_product', '_statistics')
+def _total_sales_per_product_metric(results, statistics):
+    """Общие продажи по продуктам"""
+    return pd.Series(statistics[1], index=results.df.columns)
+
+
+@register_metric('total_monthly_sales', '_statistics')
+def _total_monthly_sales_metric(results, statistics):
+    """Общие продажи по периодам"""
+    return pd.Series(statistics[2], index=results.df.index)
+
+
+@register_metric('average_monthly_sales_per_product', '_statistics')
+def _average_monthly_sales_metric(results, statistics):
+    """Средние продажи за период по продуктам"""
+    return pd.Series(statistics[0]['mean'], index=results.df.columns)
+
+
+@register_metric('month_highest_sales', 'total_monthly_sales')
+def _month_highest_sales_metric(results, total_monthly_sales):
+    """Период с наивысшими продажами"""
+    return total_monthly_sales.idxmax()
+
+
+@register_metric('product_highest_sales', 'total_sales_per_product')
+def _product_highest_sales_metric(results, total_sales_per_product):
+    """Продукт с наивысшими общими продажами"""
+    return total_sales_per_product.idxmax()
+
+
+@register_metric('_fingerprint')
+def _fingerprint_metric(results):
+    """Отпечаток данных для ключей кэша между перезапусками"""
+    return dataset_fingerprint(results.df) if results.cache is not None else None
+
+
+@register_metric('top_periods', 'total_monthly_sales')
+def _top_periods_metric(results, total_monthly_sales):
+    """Периоды с наибольшими продажами (до TOP_K_MAX)"""
+    return top_k(total_monthly_sales, TOP_K_MAX)
+
+
+@register_metric('correlation_matrix', '_fingerprint')
+def _correlation_matrix_metric(results, fingerprint):
+    """Корреляционная матрица продуктов"""
+    return compute_correlation_matrix(results.df, results.cache, fingerprint)
+
+
+@register_metric('time_rollups', '_fingerprint')
+def _time_rollups_metric(results, fingerprint):
+    """Сводки продаж по неделям, месяцам, кварталам и годам"""
+    if not isinstance(results.df.index, pd.DatetimeIndex):
+        return None
+    if results.cache is None:
+        return TimeRollupCube(results.df)
+
+    key = fingerprint + ':rollups'
+    cube = results.cache.get(key)
+    if cube is None:
+        cube = TimeRollupCube(results.df)
+        results.cache.put(key, cube, size=estimate_size(results.df))
+    return cube
+
+
+@register_metric('monthly_sales', 'time_rollups')
+def _monthly_sales_metric(results, time_rollups):
+    """Продажи по продуктам за непрерывный ряд месяцев (или по строкам без дат)"""
+    if time_rollups is None:
+        return results.df
+    monthly = time_rollups.frame('M')
+    if monthly.empty:
+        return monthly
+    # Месяцы без строк остаются пропусками, чтобы сдвиги не смешивали периоды
+    months = pd.date_range(monthly.index[0], monthly.index[-1], freq='MS', unit='ns')
+    return monthly.reindex(months)
+
+
+@register_metric('rolling_average_sales', 'monthly_sales')
+def _rolling_average_metric(results, monthly_sales):
+    """Скользящее среднее продаж за ROLLING_WINDOW периодов"""
+    return _frame_like(monthly_sales, rolling_mean(_as_matrix(monthly_sales), ROLLING_WINDOW))
+
+
+@register_metric('mom_growth', 'monthly_sales')
+def _mom_growth_metric(results, monthly_sales):
+    """Рост продаж к предыдущему периоду"""
+    return _frame_like(monthly_sales, period_growth(_as_matrix(monthly_sales), 1))
+
+
+@register_metric('yoy_growth', 'monthly_sales')
+def _yoy_growth_metric(results, monthly_sales):
+    """Рост продаж к тому же периоду прошлого года"""
+    return _frame_like(monthly_sales, period_growth(_as_matrix(monthly_sales), YOY_LAG))
+
+
+@register_metric('cumulative_sales', 'monthly_sales')
+def _cumulative_sales_metric(results, monthly_sales):
+    """Накопленные продажи (пропуски не увеличивают сумму)"""
+    return _frame_like(monthly_sales, np.nancumsum(_as_matrix(monthly_sales), axis=0))
+
+
+@register_metric('sales_trend', 'monthly_sales')
+def _sales_trend_metric(results, monthly_sales):
+    """Наклон линейного тренда продаж по продуктам (изменение за период)"""
+    return pd.Series(trend_slopes(_as_matrix(monthly_sales)), index=monthly_sales.columns)
+
+
+@register_metric('total_sales_trend', 'monthly_sales')
+def _total_sales_trend_metric(results, monthly_sales):
+    """Наклон линейного тренда общих продаж"""
+    values = _as_matrix(monthly_sales)
+    totals = np.where(np.isnan(values).all(axis=1), np.nan, np.nansum(values, axis=1))
+    return float(trend_slopes(totals[:, np.newaxis])[0])
+
+
+def analyze_sales_data(df, analysis_cache=None, approximate=False, aggregator=None):
+    """Функция для анализа данных о продажах
+
+    Возвращает LazyResults: метрики из реестра METRICS вычисляются при первом
+    обращении, поэтому скрытые разделы интерфейса ничего не стоят. При
+    approximate=True квартили оцениваются квантильным эскизом, а в описательную
+    статистику добавляется строка rank_error с границей ошибки ранга.
+    SalesAggregator, учитывший те же строки, избавляет от повторного расчета
+    статистик по всему набору.
+    """
+    # Обработка столбца с датами как индекса (исходный DataFrame не изменяется)
+    date_position, date_format = detect_date_column(df)
+    if date_position is not None:
+        dates = parse_dates(df.iloc[:, date_position], date_format)
+        other_columns = [i for i in range(df.shape[1]) if i != date_position]
+        df = df.iloc[:, other_columns].set_index(dates)
+
+    # Текстовые и категориальные столбцы не участвуют в расчетах продаж
+    if not df.empty:
+        df = df.select_dtypes(include='number')
+    if df.empty:
+        raise ValueError("Нет данных для анализа")
+
+    return LazyResults(df, analysis_cache, approximate=approximate, aggregator=aggregator), df
+
+
+def lttb_indices(x, y, threshold):
+    """Индексы точек ряда, отобранных методом Largest-Triangle-Three-Buckets
+
+    Первая и последняя точки сохраняются, из каждой из остальных корзин
+    берется точка, образующая наибольший треугольник с выбранной точкой
+    предыдущей корзины и средней точкой следующей - так сохраняются пики и провалы.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def downsample_series(series, max_points=LINE_CHART_MAX_POINTS):
+    """Прореживание ряда для линейного графика с сохранением формы (LTTB)"""
+    if len(series) <= max_points:
+        return series
+    index = series.index
+    if isinstance(index, pd.DatetimeIndex):
+        x = (index - index[0]) / pd.Timedelta(days=1)
+    elif pd.api.types.is_numeric_dtype(index.dtype):
+        x = index.to_numpy(dtype=np.float64)
+    else:
+        x = np.arange(len(series))
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return series.iloc[lttb_indices(x, np.nan_to_num(values), max_points)]
+
+
+def _total_sales_chart_data(results, granularity=None):
+    """Ряд общих продаж и заголовок: по строкам данных или по уровню сводки"""
+    if granularity is not None:
+        return (results['time_rollups'].totals(ROLLUP_LEVELS[granularity]),
+                f'Общие продажи по периодам: {granularity.lower()}')
+    return results['total_monthly_sales'], 'Общие ежемесячные продажи'
+
+
+def _product_sales_chart_data(results):
+    """Продажи по продуктам и заголовок (для больших каталогов - только лидеры)"""
+    product_sales = results['total_sales_per_product']
+    if len(product_sales) > BAR_CHART_MAX_PRODUCTS:
+        return (top_k(product_sales, BAR_CHART_MAX_PRODUCTS),
+                f'Общие продажи: топ {BAR_CHART_MAX_PRODUCTS} продуктов')
+    return product_sales, 'Общие продажи по продуктам'
+
+
+def _correlation_chart_data(df, results, reorder=False):
+    """Корреляционная матрица из результатов (None, если нет исходных строк)"""
+    correlation_matrix = results.get('correlation_matrix')
+    if correlation_matrix is None and df is not None:
+        correlation_matrix = compute_correlation_matrix(df)
+    if correlation_matrix is not None and reorder:
+        order = correlation_order(correlation_matrix)
+        correlation_matrix = correlation_matrix.iloc[order, order]
+    return correlation_matrix
+
+
+def create_plotly_visualizations(df, results, granularity=None, reorder=False):
+    """Интерактивные графики Plotly: масштабирование без перезапуска скрипта"""
+    if go is None:
+        raise ImportError("Для интерактивных графиков установите plotly")
+
+    # Длинные ряды рисуются через WebGL (Scattergl) и прореживаются мягче, чем PNG
+    total_sales, title = _total_sales_chart_data(results, granularity)
+    total_sales = downsample_series(total_sales, PLOTLY_MAX_POINTS)
+    trace = go.Scattergl if len(total_sales) > PLOTLY_WEBGL_MIN_POINTS else go.Scatter
+    mode = 'lines+markers' if len(total_sales) <= LINE_CHART_MARKER_MAX_POINTS else 'lines'
+    fig1 = go.Figure(trace(x=total_sales.index, y=total_sales.to_numpy(), mode=mode,
+                           name='Общие продажи'))
+    fig1.update_layout(title=title, xaxis_title='Дата', yaxis_title='Общие продажи')
+
+    product_sales, title = _product_sales_chart_data(results)
+    fig2 = go.Figure(go.Bar(x=product_sales.index.astype(str), y=product_sales.to_numpy(),
+                            text=product_sales.to_numpy(), texttemplate='%{text:,.0f}',
+                            marker_color='skyblue'))
+    fig2.update_layout(title=title, xaxis_title='Продукт', yaxis_title='Общие продажи')
+
+    fig3 = None
+    correlation_matrix = _correlation_chart_data(df, results, reorder)
+    if correlation_matrix is not None:
+        annotate = len(correlation_matrix) <= HEATMAP_ANNOTATION_MAX_PRODUCTS
+        fig3 = go.Figure(go.Heatmap(z=correlation_matrix.to_numpy(),
+                                    x=correlation_matrix.columns.astype(str),
+                                    y=correlation_matrix.index.astype(str),
+                                    colorscale='RdBu_r', zmid=0,
+                                    texttemplate='%{z:.2f}' if annotate else None))
+        fig3.update_layout(title='Корреляция между продуктами')
+
+    return fig1, fig2, fig3
+
+
+def create_sales_trend_figure(results, granularity=None):
+    """График динамики общих продаж (matplotlib)"""
+    # Длинные ряды прореживаются до бюджета точек, маркеры - только для коротких
+    total_sales, title = _total_sales_chart_data(results, granularity)
+    total_sales = downsample_series(total_sales)
     fig1, ax1 = plt.subplots(figsize=(12, 6))
-    ax1.plot(results['total_monthly_sales'].index,
-             results['total_monthly_sales'].values, marker='o')
-    ax1.set_title('Общие ежемесячные продажи', fontsize=16, fontweight='bold')
+    ax1.plot(total_sales.index, total_sales.values,
+             marker='o' if len(total_sales) <= LINE_CHART_MARKER_MAX_POINTS else None)
+    ax1.set_title(title, fontsize=16, fontweight='bold')
     ax1.set_xlabel('Дата')
     ax1.set_ylabel('Общие продажи')
     ax1.grid(True, alpha=0.3)
     plt.xticks(rotation=45)
     plt.tight_layout()
+    return fig1
+
 
-    # График общих продаж по продуктам
+def create_product_sales_figure(results):
+    """График общих продаж по продуктам (matplotlib)"""
+    product_sales, title = _product_sales_chart_data(results)
     fig2, ax2 = plt.subplots(figsize=(10, 6))
-    bars = ax2.bar(results['total_sales_per_product'].index,
-                   results['total_sales_per_product'].values, color='skyblue')
-    ax2.set_title('Общие продажи по продуктам', fontsize=16, fontweight='bold')
+    bars = ax2.bar(product_sales.index.astype(str), product_sales.values, color='skyblue')
+    ax2.set_title(title, fontsize=16, fontweight='bold')
     ax2.set_xlabel('Продукт')
     ax2.set_ylabel('Общие продажи')
 
@@ -79,15 +2042,359 @@ def create_visualizations(df, results):
                  ha='center', va='bottom')
 
     plt.tight_layout()
+    return fig2
 
-    # Тепловая карта корреляций
+
+def create_correlation_figure(df, results, reorder=False):
+    """Тепловая карта корреляций (None, если нет исходных строк)
+
+    До HEATMAP_ANNOTATION_MAX_PRODUCTS продуктов ячейки подписываются значениями,
+    для больших матриц рисуется одно растровое изображение без текста.
+    """
+    correlation_matrix = _correlation_chart_data(df, results, reorder)
+    if correlation_matrix is None:
+        return None
     fig3, ax3 = plt.subplots(figsize=(8, 6))
-    correlation_matrix = df.corr()
-    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', center=0, ax=ax3)
+    n_products = len(correlation_matrix)
+    if n_products <= HEATMAP_ANNOTATION_MAX_PRODUCTS:
+        sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', center=0, ax=ax3)
+    else:
+        image = ax3.imshow(correlation_matrix.to_numpy(dtype=np.float64), cmap='coolwarm',
+                           vmin=-1, vmax=1, interpolation='nearest', aspect='auto')
+        fig3.colorbar(image, ax=ax3)
+        if n_products <= HEATMAP_TICK_MAX_PRODUCTS:
+            labels = correlation_matrix.columns.astype(str)
+            ax3.set_xticks(np.arange(n_products), labels, rotation=90, fontsize=6)
+            ax3.set_yticks(np.arange(n_products), labels, fontsize=6)
+        else:
+            ax3.set_xticks([])
+            ax3.set_yticks([])
     ax3.set_title('Корреляция между продуктами', fontsize=16, fontweight='bold')
     plt.tight_layout()
+    return fig3
 
-    return fig1, fig2, fig3
+
+def create_visualizations(df, results, granularity=None, backend='matplotlib', reorder=False):
+    """Создание визуализаций (backend: 'matplotlib' или 'plotly')"""
+    if backend == 'plotly':
+        return create_plotly_visualizations(df, results, granularity, reorder)
+
+    return (create_sales_trend_figure(results, granularity),
+            create_product_sales_figure(results),
+            create_correlation_figure(df, results, reorder))
+
+
+def figure_png(figure):
+    """Растеризация фигуры matplotlib в PNG с освобождением ее памяти"""
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=CHART_DPI)
+    plt.close(figure)
+    return buffer.getvalue()
+
+
+def results_fingerprint(results):
+    """Отпечаток данных анализа для ключей кэша (None для потоковых итогов)"""
+    if not isinstance(results, LazyResults):
+        return None
+    return results['_fingerprint'] or dataset_fingerprint(results.df)
+
+
+def cached_chart_png(cache, key, build):
+    """PNG графика из кэша или построенный функцией build (None - графика нет)"""
+    png = cache.get(key) if cache is not None and key is not None else None
+    if png is None:
+        figure = build()
+        if figure is None:
+            return None
+        png = figure_png(figure)
+        if cache is not None and key is not None:
+            cache.put(key, png)
+    return png
+
+
+def render_data_overview(df, n_rows=None, n_cols=None, missing=None):
+    """Отображение раздела с обзором данных"""
+    st.header("1. 📋 Обзор данных")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Количество строк", df.shape[0] if n_rows is None else n_rows)
+    with col2:
+        st.metric("Количество столбцов", df.shape[1] if n_cols is None else n_cols)
+    with col3:
+        st.metric("Пропущенные значения",
+                  df.isnull().sum().sum() if missing is None else missing)
+
+    # Объем памяти до и после оптимизации типов
+    if 'original_memory' in df.attrs:
+        original_memory = df.attrs['original_memory']
+        current_memory = estimate_size(df)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Память до оптимизации", format_bytes(original_memory))
+        with col2:
+            saved = 1 - current_memory / original_memory if original_memory else 0
+            st.metric("Память после оптимизации", format_bytes(current_memory),
+                      delta=f"-{saved:.0%}", delta_color="inverse")
+
+    # Показать первые несколько строк
+    st.subheader("Первые 5 строк данных:")
+    st.dataframe(df.head())
+
+    # Информация о типах данных
+    st.subheader("Информация о столбцах:")
+    buffer = io.StringIO()
+    df.info(buf=buffer)
+    info_str = buffer.getvalue()
+    st.text(info_str)
+
+
+def render_statistics(results):
+    """Раздел описательной статистики"""
+    st.header("2. 📊 Статистический анализ")
+    st.subheader("Описательная статистика:")
+    st.dataframe(results['basic_stats'])
+    if 'rank_error' in results['basic_stats'].index:
+        st.caption("Квартили приближенные. rank_error - граница ошибки ранга: при 0.004 "
+                   "оценка 50% лежит между 49.6% и 50.4% значений столбца")
+
+
+def render_key_metrics(results):
+    """Раздел ключевых показателей и рейтингов"""
+    st.header("3. 🎯 Ключевые показатели")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("Общие продажи по продуктам:")
+        st.dataframe(results['total_sales_per_product'])
+
+        st.subheader("Средние ежемесячные продажи:")
+        st.dataframe(results['average_monthly_sales_per_product'])
+
+    with col2:
+        st.subheader("Топ показатели:")
+        st.write(f"**Продукт с наивысшими продажами:** {results['product_highest_sales']}")
+        if hasattr(results['month_highest_sales'], 'strftime'):
+            st.write(f"**Месяц с наивысшими продажами:** "
+                     f"{results['month_highest_sales'].strftime('%Y-%m-%d')}")
+        else:
+            st.write(f"**Период с наивысшими продажами:** "
+                     f"{results['month_highest_sales']}")
+
+        # Рейтинги частичным отбором, без сортировки всего каталога
+        k = int(st.number_input("Размер рейтинга", min_value=1, max_value=TOP_K_MAX,
+                                value=TOP_K_DEFAULT))
+        totals = results['total_sales_per_product']
+        st.subheader(f"Топ {k} продуктов:")
+        for i, (product, sales) in enumerate(top_k(totals, k).items(), 1):
+            st.write(f"{i}. {product}: {sales:,.0f}")
+
+        if len(totals) > k:
+            st.subheader("Продукты с наименьшими продажами:")
+            for i, (product, sales) in enumerate(top_k(totals, k, largest=False).items(), 1):
+                st.write(f"{i}. {product}: {sales:,.0f}")
+
+        st.subheader("Периоды с наибольшими продажами:")
+        for i, (period, sales) in enumerate(results['top_periods'].head(k).items(), 1):
+            label = period.strftime('%Y-%m-%d') if hasattr(period, 'strftime') else period
+            st.write(f"{i}. {label}: {sales:,.0f}")
+
+    # Динамика продуктов на последний период
+    if 'sales_trend' in results:
+        st.subheader("Динамика продуктов (последний период):")
+        st.dataframe(pd.DataFrame({
+            f'Скользящее среднее ({ROLLING_WINDOW})': results['rolling_average_sales'].iloc[-1],
+            'Рост к прошлому периоду, %': results['mom_growth'].iloc[-1] * 100,
+            'Рост за год, %': results['yoy_growth'].iloc[-1] * 100,
+            'Накопленные продажи': results['cumulative_sales'].iloc[-1],
+            'Тренд за период': results['sales_trend'],
+        }))
+
+
+def render_visualizations(results, processed_df, backend='matplotlib'):
+    """Раздел графиков"""
+    st.header("4. 📈 Визуализация данных")
+
+    # Детализация доступна, если строки привязаны к датам
+    granularity = None
+    if results.get('time_rollups') is not None:
+        selected = st.selectbox("Детализация", ["Как в данных"] + list(ROLLUP_LEVELS))
+        granularity = selected if selected in ROLLUP_LEVELS else None
+
+    correlation_matrix = results.get('correlation_matrix')
+    reorder = False
+    if correlation_matrix is not None and len(correlation_matrix) > 2:
+        reorder = st.checkbox("Упорядочить продукты по сходству",
+                              help="Сильно связанные продукты собираются в блоки "
+                                   "вдоль диагонали тепловой карты")
+
+    try:
+        if backend == 'plotly':
+            charts = create_plotly_visualizations(processed_df, results, granularity, reorder)
+            show_chart = st.plotly_chart
+        else:
+            # Неизменившиеся графики берутся из кэша PNG без повторной растеризации
+            chart_cache = get_session_cache('chart_cache', max_entries=CHART_CACHE_MAX_ENTRIES,
+                                            max_bytes=CHART_CACHE_MAX_BYTES)
+            fingerprint = results_fingerprint(results)
+            charts = [
+                cached_chart_png(chart_cache, fingerprint and (fingerprint, name, options), build)
+                for name, options, build in [
+                    ('trend', granularity,
+                     lambda: create_sales_trend_figure(results, granularity)),
+                    ('products', BAR_CHART_MAX_PRODUCTS,
+                     lambda: create_product_sales_figure(results)),
+                    ('correlation', reorder,
+                     lambda: create_correlation_figure(processed_df, results, reorder)),
+                ]
+            ]
+
+            def show_chart(png):
+                """Вывод растеризованного графика на всю ширину"""
+                st.image(png, width='stretch')
+
+        # График временных рядов
+        st.subheader("Динамика общих продаж:")
+        show_chart(charts[0])
+
+        # График по продуктам
+        st.subheader("Сравнение продуктов:")
+        show_chart(charts[1])
+
+        # Корреляционная матрица (недоступна без исходных строк)
+        if charts[2] is not None:
+            st.subheader("Корреляция между продуктами:")
+            show_chart(charts[2])
+
+        if correlation_matrix is not None and len(correlation_matrix) > 1:
+            st.subheader("Наиболее связанные пары продуктов:")
+            st.dataframe(top_correlated_pairs(correlation_matrix), hide_index=True)
+
+        plt.close('all')  # Закрыть все фигуры для освобождения памяти
+
+    except Exception as e:
+        st.error(f"Ошибка создания графиков: {e}")
+
+
+def render_report(results, n_records):
+    """Раздел итогового отчета с кнопкой скачивания"""
+    st.header("5. 📝 Итоговый отчет")
+
+    correlation_matrix = results.get('correlation_matrix')
+    max_correlation = (max_pairwise_correlation(correlation_matrix)
+                       if correlation_matrix is not None else None)
+    if max_correlation is not None:
+        correlation_text = (f"Наибольшая корреляция наблюдается между продуктами с коэффициентом "
+                            f"{max_correlation:.3f}")
+    elif correlation_matrix is not None:
+        correlation_text = "Для расчета корреляции недостаточно продуктов или данных"
+    else:
+        correlation_text = "Корреляция между продуктами не рассчитывается в потоковом режиме"
+
+    # Тренд по наклону регрессии, в потоковом режиме - по первому и последнему периоду
+    total_sales = results['total_monthly_sales']
+    if 'total_sales_trend' in results and not np.isnan(results['total_sales_trend']):
+        slope = results['total_sales_trend']
+        direction = 'восходящий' if slope > 0 else 'нисходящий'
+        # Наклон считается по месячным итогам, поэтому и сравнивается со средним за месяц
+        monthly_mean = results['monthly_sales'].sum(axis=1).mean()
+        trend_text = (f"Продажи показывают {direction} тренд: "
+                      f"{slope:+,.0f} за период ({slope / monthly_mean:+.1%} от среднего)")
+    else:
+        direction = 'восходящий' if total_sales.iloc[-1] > total_sales.iloc[0] else 'нисходящий'
+        trend_text = f"Продажи показывают {direction} тренд"
+
+    report = f"""
+    ## Отчет по анализу данных о продажах
+
+    ### Основные результаты:
+    - **Общее количество записей:** {n_records}
+    - **Количество продуктов:** {len(results['total_sales_per_product'])}
+    - **Лучший продукт:** {results['product_highest_sales']}
+      (общие продажи: {results['total_sales_per_product'][results['product_highest_sales']]:,.0f})
+    - **Средние продажи за период:** {results['total_monthly_sales'].mean():,.0f}
+    - **Максимальные продажи за месяц:** {results['total_monthly_sales'].max():,.0f}
+    - **Минимальные продажи за месяц:** {results['total_monthly_sales'].min():,.0f}
+
+    ### Выводы:
+    - {trend_text}
+    - {correlation_text}
+    - Стандартное отклонение общих продаж: {results['total_monthly_sales'].std():,.0f}
+
+    ### Использованные библиотеки:
+    - **pandas**: Обработка и анализ данных
+    - **matplotlib**: Визуализация данных
+    - **seaborn**: Статистическая визуализация
+    - **streamlit**: Веб-интерфейс приложения
+    """
+
+    st.markdown(report)
+
+    # Кнопка для скачивания отчета
+    st.download_button(
+        label="📥 Скачать отчет (TXT)",
+        data=report,
+        file_name=f"sales_analysis_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain"
+    )
+
+
+def render_analysis(results, processed_df, n_records, backend='matplotlib', section=None):
+    """Отображение результатов анализа: выбранный раздел или все (section=None)
+
+    Метрики вычисляются лениво, поэтому невыбранные разделы ничего не стоят.
+    """
+    if section in (None, ANALYSIS_SECTIONS[0]):
+        render_statistics(results)
+    if section in (None, ANALYSIS_SECTIONS[1]):
+        render_key_metrics(results)
+    if section in (None, ANALYSIS_SECTIONS[2]):
+        render_visualizations(results, processed_df, backend)
+    if section in (None, ANALYSIS_SECTIONS[3]):
+        render_report(results, n_records)
+
+
+def select_analysis_section():
+    """Выбор раздела анализа (None - все разделы на одной странице)"""
+    section = st.radio("Раздел анализа", ANALYSIS_SECTIONS + [ALL_SECTIONS], horizontal=True,
+                       help="Считается и отображается только выбранный раздел")
+    return None if section == ALL_SECTIONS else section
+
+
+def session_analysis(df, approximate=False, aggregator=None):
+    """Результаты анализа набора сессии, переиспользуемые между перезапусками
+
+    Ленивые результаты хранятся в session_state, пока набор данных тот же
+    объект: уже вычисленные метрики не пересчитываются при смене раздела.
+    Статистики дописанного набора берутся из агрегатора сессии.
+    """
+    stored = st.session_state.get('analysis')
+    if stored is not None and stored[0] is df and stored[1] == approximate:
+        return stored[2], stored[3]
+
+    analysis_cache = get_session_cache('analysis_cache',
+                                       max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                                       max_bytes=ANALYSIS_CACHE_MAX_BYTES)
+    results, processed_df = analyze_sales_data(df, analysis_cache, approximate, aggregator)
+    st.session_state['analysis'] = (df, approximate, results, processed_df)
+    return results, processed_df
+
+
+def render_parse_progress(job):
+    """Индикатор фонового разбора файла с кнопкой отмены"""
+    progress = job.progress
+    if progress['sheet_count'] > 1:
+        text = f"Чтение листов: {progress['sheets_done']} из {progress['sheet_count']}"
+    else:
+        text = (f"Чтение листа «{progress['sheet']}»: "
+                f"{progress['rows']:,} из {progress['total_rows']:,} строк")
+    st.sidebar.progress(job.fraction, text=text)
+    if st.sidebar.button("Отменить загрузку"):
+        job.cancel()
+        st.sidebar.warning("Загрузка отменена, удалите файл из списка")
+    else:
+        st.sidebar.info("Файл загружается, результаты появятся автоматически")
 
 
 def main():
@@ -108,23 +2415,84 @@ def main():
                 'Продукт_2': [1500, 1400, 1600, 1550, 1700, 1650, 1800, 1750, 1850, 1900, 1950, 2000],
                 'Продукт_3': [800, 850, 900, 875, 950, 925, 1000, 975, 1050, 1100, 1150, 1200]
             })
-            st.session_state['uploaded_data'] = example_df
+            st.session_state['uploaded_data'] = optimize_dtypes(example_df)
+            st.session_state.pop('streamed_analysis', None)
+            st.session_state.pop('ingested_files', None)
+            st.session_state.pop('session_aggregator', None)
             st.sidebar.success("Пример данных загружен!")
         except Exception as e:
             st.sidebar.error(f"Ошибка создания примера данных: {e}")
 
-    # Загрузка пользовательского файла
-    uploaded_file = st.sidebar.file_uploader(
-        "Выберите Excel файл",
-        type=['xlsx', 'xls'],
-        help="Загрузите Excel файл с данными о продажах"
+    # Загрузка пользовательских файлов (например, по файлу на месяц)
+    uploaded_files = st.sidebar.file_uploader(
+        "Выберите файлы с данными",
+        type=list(EXCEL_EXTENSIONS + COLUMNAR_EXTENSIONS),
+        accept_multiple_files=True,
+        help="Загрузите Excel, CSV, Parquet или Feather файлы с данными о продажах. "
+             "Новые файлы добавляются к уже загруженным, повторы дат заменяются"
+    ) or []
+    # Фоновый разбор убранных из списка файлов останавливается
+    prune_parse_jobs(uploaded_files)
+    input_format = st.sidebar.radio(
+        "Формат данных",
+        ["Широкий (столбец на продукт)", "Длинный (транзакции)"],
+        help="Длинный формат: строка на продажу со столбцами даты, продукта и суммы"
+    )
+    stream_mode = st.sidebar.checkbox(
+        "Потоковое чтение (экономия памяти)",
+        help="Файл читается порциями, в памяти хранятся только итоги по продуктам "
+             "или сводная таблица транзакций. Подходит для файлов больше памяти"
+    )
+    chart_backend = 'matplotlib'
+    if go is not None:
+        chart_backend = CHART_BACKENDS[st.sidebar.radio(
+            "Графики", list(CHART_BACKENDS),
+            help="Интерактивные графики масштабируются в браузере без перезапуска анализа"
+        )]
+    approximate = st.sidebar.checkbox(
+        "Приближенные квартили (очень большие данные)",
+        help="Квартили оцениваются квантильным эскизом за один проход с ограниченной "
+             "памятью; граница ошибки показывается в описательной статистике"
     )
 
-    if uploaded_file is not None:
+    pending_job = None
+    if uploaded_files:
         try:
-            df = pd.read_excel(uploaded_file)
-            st.session_state['uploaded_data'] = df
-            st.sidebar.success("Файл успешно загружен!")
+            parse_cache = get_session_cache('parse_cache',
+                                            max_entries=PARSE_CACHE_MAX_ENTRIES,
+                                            max_bytes=PARSE_CACHE_MAX_BYTES)
+            first_file = uploaded_files[0]
+            if (stream_mode and len(uploaded_files) == 1
+                    and file_extension(first_file.name) in STREAM_EXTENSIONS):
+                if input_format == "Длинный (транзакции)":
+                    st.session_state['uploaded_data'] = load_streamed_long_data(first_file,
+                                                                                parse_cache)
+                    st.session_state.pop('streamed_analysis', None)
+                else:
+                    st.session_state['streamed_analysis'] = load_streamed_analysis(first_file,
+                                                                                   parse_cache)
+                    st.session_state.pop('uploaded_data', None)
+                st.session_state.pop('ingested_files', None)
+                st.session_state.pop('session_aggregator', None)
+            else:
+                # Выбор листов доступен для одной книги, настройки длинного
+                # формата определяются по первому файлу и применяются ко всем
+                sheet_options = None
+                if len(uploaded_files) == 1 and file_extension(first_file.name) in EXCEL_EXTENSIONS:
+                    sheet_options = select_workbook_sheets(first_file, parse_cache)
+                long_options = None
+                if input_format == "Длинный (транзакции)":
+                    first_df = load_wide_data(first_file, parse_cache, DATASET_STORE_DIR,
+                                              sheet_options)
+                    long_options = select_long_format_options(first_df)
+
+                st.session_state['uploaded_data'] = ingest_uploaded_files(
+                    uploaded_files, parse_cache, DATASET_STORE_DIR, sheet_options, long_options)
+                st.session_state.pop('streamed_analysis', None)
+            st.sidebar.success(f"Загружено файлов: {len(uploaded_files)}")
+        except ParsePending as pending:
+            pending_job = pending.job
+            render_parse_progress(pending_job)
         except Exception as e:
             st.sidebar.error(f"Ошибка загрузки файла: {e}")
 
@@ -133,130 +2501,34 @@ def main():
         df = st.session_state['uploaded_data']
 
         # Отображение базовой информации о данных
-        st.header("1. 📋 Обзор данных")
+        render_data_overview(df)
 
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Количество строк", df.shape[0])
-        with col2:
-            st.metric("Количество столбцов", df.shape[1])
-        with col3:
-            st.metric("Пропущенные значения", df.isnull().sum().sum())
-
-        # Показать первые несколько строк
-        st.subheader("Первые 5 строк данных:")
-        st.dataframe(df.head())
-
-        # Информация о типах данных
-        st.subheader("Информация о столбцах:")
-        buffer = io.StringIO()
-        df.info(buf=buffer)
-        info_str = buffer.getvalue()
-        st.text(info_str)
-
-        # Проведение анализа
+        # Проведение анализа: строится только выбранный раздел
+        section = select_analysis_section()
         try:
-            results, processed_df = analyze_sales_data(df.copy())
+            results, processed_df = session_analysis(
+                df, approximate, st.session_state.get('session_aggregator'))
+            render_analysis(results, processed_df, df.shape[0], chart_backend, section)
 
-            # Статистический анализ
-            st.header("2. 📊 Статистический анализ")
-            st.subheader("Описательная статистика:")
-            st.dataframe(results['basic_stats'])
-
-            # Ключевые показатели
-            st.header("3. 🎯 Ключевые показатели")
-
-            col1, col2 = st.columns(2)
-
-            with col1:
-                st.subheader("Общие продажи по продуктам:")
-                st.dataframe(results['total_sales_per_product'])
-
-                st.subheader("Средние ежемесячные продажи:")
-                st.dataframe(results['average_monthly_sales_per_product'])
-
-            with col2:
-                st.subheader("Топ показатели:")
-                st.write(f"**Продукт с наивысшими продажами:** {results['product_highest_sales']}")
-                if hasattr(results['month_highest_sales'], 'strftime'):
-                    st.write(f"**Месяц с наивысшими продажами:** "
-                             f"{results['month_highest_sales'].strftime('%Y-%m-%d')}")
-                else:
-                    st.write(f"**Период с наивысшими продажами:** "
-                             f"{results['month_highest_sales']}")
-
-                # Топ 3 продукта
-                top_products = results['total_sales_per_product'].nlargest(3)
-                st.subheader("Топ 3 продукта:")
-                for i, (product, sales) in enumerate(top_products.items(), 1):
-                    st.write(f"{i}. {product}: {sales:,.0f}")
+        except Exception as e:
+            st.error(f"Ошибка анализа данных: {e}")
+            st.info("Убедитесь, что ваш файл содержит данные в правильном формате.")
 
-            # Визуализации
-            st.header("4. 📈 Визуализация данных")
-
-            try:
-                fig1, fig2, fig3 = create_visualizations(processed_df, results)
-
-                # График временных рядов
-                st.subheader("Динамика общих продаж:")
-                st.pyplot(fig1)
-
-                # График по продуктам
-                st.subheader("Сравнение продуктов:")
-                st.pyplot(fig2)
-
-                # Корреляционная матрица
-                st.subheader("Корреляция между продуктами:")
-                st.pyplot(fig3)
-
-                plt.close('all')  # Закрыть все фигуры для освобождения памяти
-
-            except Exception as e:
-                st.error(f"Ошибка создания графиков: {e}")
-
-            # Отчет
-            st.header("5. 📝 Итоговый отчет")
-
-            report = f"""
-            ## Отчет по анализу данных о продажах
-
-            ### Основные результаты:
-            - **Общее количество записей:** {df.shape[0]}
-            - **Количество продуктов:** {df.shape[1] - 1}
-            - **Лучший продукт:** {results['product_highest_sales']}
-              (общие продажи: {results['total_sales_per_product'][results['product_highest_sales']]:,.0f})
-            - **Средние продажи за период:** {results['total_monthly_sales'].mean():,.0f}
-            - **Максимальные продажи за месяц:** {results['total_monthly_sales'].max():,.0f}
-            - **Минимальные продажи за месяц:** {results['total_monthly_sales'].min():,.0f}
-
-            ### Выводы:
-            - Продажи показывают {'восходящий' if results['total_monthly_sales'].iloc[-1] > results['total_monthly_sales'].iloc[0] else 'нисходящий'} тренд
-            - Наибольшая корреляция наблюдается между продуктами с коэффициентом {processed_df.corr().values[processed_df.corr().values != 1].max():.3f}
-            - Стандартное отклонение общих продаж: {results['total_monthly_sales'].std():,.0f}
-
-            ### Использованные библиотеки:
-            - **pandas**: Обработка и анализ данных
-            - **matplotlib**: Визуализация данных
-            - **seaborn**: Статистическая визуализация
-            - **streamlit**: Веб-интерфейс приложения
-            """
-
-            st.markdown(report)
-
-            # Кнопка для скачивания отчета
-            st.download_button(
-                label="📥 Скачать отчет (TXT)",
-                data=report,
-                file_name=f"sales_analysis_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain"
-            )
+    elif 'streamed_analysis' in st.session_state:
+        aggregator, preview = st.session_state['streamed_analysis']
 
+        render_data_overview(preview, n_rows=aggregator.n_rows, n_cols=preview.shape[1],
+                             missing=aggregator.missing_values)
+        section = select_analysis_section()
+        try:
+            render_analysis(aggregator.results(), None, aggregator.n_rows, chart_backend,
+                            section)
         except Exception as e:
             st.error(f"Ошибка анализа данных: {e}")
             st.info("Убедитесь, что ваш файл содержит данные в правильном формате.")
 
     else:
-        st.info("👆 Пожалуйста, загрузите Excel файл для начала анализа")
+        st.info("👆 Пожалуйста, загрузите файл с данными для начала анализа")
 
         # Показать пример структуры данных
         st.subheader("Ожидаемая структура данных:")
@@ -268,6 +2540,11 @@ def main():
         })
         st.dataframe(example_structure)
 
+    # Пока файл разбирается в фоне, страница периодически обновляет прогресс
+    if pending_job is not None and not pending_job.cancelled:
+        time.sleep(PROGRESS_POLL_SECONDS)
+        st.rerun()
+
 
 if __name__ == "__main__":
     main()
@@ -6,14 +6,40 @@
 import unittest
 import pandas as pd
 import numpy as np
+import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import sys
 import os
+import io
+import tempfile
+import threading
+import tracemalloc
+import openpyxl
+from unittest.mock import MagicMock, patch
 
 # Добавляем корневую директорию в PYTHONPATH
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import streamlit_app
 from streamlit_app import analyze_sales_data, create_visualizations
+from streamlit_app import LRUCache, load_uploaded_file, load_streamed_analysis
+from streamlit_app import read_uploaded_bytes, read_excel_sheets, load_excel_sheets
+from streamlit_app import combine_sheets, optimize_dtypes
+from streamlit_app import save_dataset, load_stored_dataset
+from streamlit_app import append_dataset, ingest_uploaded_files
+from streamlit_app import read_excel_rows, ParseJob, ParseCancelled
+from streamlit_app import compute_sales_statistics, SalesAggregator
+from streamlit_app import compute_correlation_matrix, dataset_fingerprint
+from streamlit_app import LazyResults, METRICS, TimeRollupCube
+from streamlit_app import rolling_mean, period_growth, trend_slopes
+from streamlit_app import top_k, StreamingTopK
+from streamlit_app import iter_dataset_chunks, analyze_sales_chunks, pivot_long_chunks
+from streamlit_app import pivot_long_sales, QuantileSketch, parallel_sales_statistics
+from streamlit_app import sketch_sales_statistics
+from streamlit_app import lttb_indices, downsample_series
+from streamlit_app import cached_chart_png, results_fingerprint, create_sales_trend_figure
+from streamlit_app import correlation_order, top_correlated_pairs, create_correlation_figure
+from streamlit_app import session_analysis, render_analysis, ANALYSIS_SECTIONS
 
 
 class TestAnalysisFunctions(unittest.TestCase):
@@ -241,6 +267,1317 @@ class TestDataValidation(unittest.TestCase):
             print(f"Expected exception with mixed data types: {e}")
 
 
+class TestParseCache(unittest.TestCase):
+    """Тесты кэша разобранных файлов"""
+
+    def _make_upload(self, df, name='sales.xlsx'):
+        """Создание объекта, имитирующего загруженный файл Streamlit"""
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        upload = MagicMock()
+        upload.name = name
+        upload.getvalue.return_value = buffer.getvalue()
+        return upload
+
+    def test_lru_eviction_by_entries(self):
+        """Тест вытеснения самой старой записи при превышении числа записей"""
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1, size=1)
+        cache.put('b', 2, size=1)
+        cache.get('a')  # 'a' становится недавно использованной
+        cache.put('c', 3, size=1)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_lru_eviction_by_size(self):
+        """Тест вытеснения записей при превышении лимита памяти"""
+        cache = LRUCache(max_entries=10, max_bytes=100)
+        cache.put('a', b'x' * 60)
+        cache.put('b', b'y' * 60)
+
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.total_bytes, 60)
+
+        # Объект больше всего кэша не сохраняется
+        cache.put('c', b'z' * 200)
+        self.assertNotIn('c', cache)
+        self.assertIn('b', cache)
+
+    def test_load_uploaded_file_uses_cache(self):
+        """Тест повторной загрузки файла из кэша без разбора"""
+        df = pd.DataFrame({'Дата': pd.date_range('2020-01-01', periods=3, freq='MS'),
+                           'Продукт_1': [1, 2, 3]})
+        upload = self._make_upload(df)
+        cache = LRUCache(max_entries=4)
+
+        first = load_uploaded_file(upload, cache)
+        with patch('streamlit_app.read_uploaded_bytes') as mock_read:
+            second = load_uploaded_file(upload, cache)
+            mock_read.assert_not_called()
+
+        self.assertIs(first, second)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(list(first['Продукт_1']), [1, 2, 3])
+
+    def test_dataset_store_reuses_columnar_copy(self):
+        """Тест повторной загрузки из колоночного хранилища без разбора Excel"""
+        df = pd.DataFrame({'Дата': pd.date_range('2020-01-01', periods=3, freq='MS'),
+                           'Продукт_1': [1, 2, 3]})
+        upload = self._make_upload(df)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            first = load_uploaded_file(upload, LRUCache(), store_dir)
+            self.assertEqual(len(os.listdir(store_dir)), 1)
+
+            # Новая сессия: пустой кэш, но файл уже есть в хранилище
+            with patch('streamlit_app.read_uploaded_bytes') as mock_read:
+                second = load_uploaded_file(upload, LRUCache(), store_dir)
+                mock_read.assert_not_called()
+
+            self.assertIsInstance(second['Продукт_1'].dtype, pd.ArrowDtype)
+            self.assertEqual(list(second['Продукт_1']), list(first['Продукт_1']))
+            results, processed_df = analyze_sales_data(second)
+            self.assertEqual(results['total_sales_per_product']['Продукт_1'], 6)
+
+    def test_dataset_store_falls_back_for_mixed_types(self):
+        """Тест загрузки данных, которые нельзя сохранить в Arrow"""
+        df = pd.DataFrame({'Продукт_1': [1, 2, 3], 'Mixed': [100, 'text', 300]})
+        upload = self._make_upload(df)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            loaded = load_uploaded_file(upload, None, store_dir)
+
+        self.assertEqual(list(loaded['Mixed']), [100, 'text', 300])
+
+    def test_dataset_store_concurrent_saves(self):
+        """Тест одновременного сохранения одного ключа из нескольких потоков"""
+        df = pd.DataFrame({'Продукт_1': np.arange(20000)})
+        errors = []
+
+        def save(store_dir):
+            try:
+                save_dataset('same_key', df, store_dir)
+            except OSError as error:
+                errors.append(error)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            threads = [threading.Thread(target=save, args=(store_dir,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(store_dir), ['same_key.arrow'])
+            self.assertEqual(len(load_stored_dataset('same_key', store_dir)), 20000)
+
+    def test_dataset_store_corrupted_file(self):
+        """Тест поврежденного файла хранилища: повторный разбор вместо ошибки"""
+        df = pd.DataFrame({'Дата': pd.date_range('2020-01-01', periods=3, freq='MS'),
+                           'Продукт_1': [1, 2, 3]})
+        upload = self._make_upload(df)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            load_uploaded_file(upload, None, store_dir)
+            path = os.path.join(store_dir, os.listdir(store_dir)[0])
+            with open(path, 'wb') as handle:
+                handle.write(b'not an arrow file')
+
+            loaded = load_uploaded_file(upload, None, store_dir)
+
+            self.assertEqual(list(loaded['Продукт_1']), [1, 2, 3])
+            self.assertEqual(len(load_stored_dataset(os.path.basename(path)[:-6],
+                                                     store_dir)), 3)
+
+
+class TestStreamingExcelAnalysis(unittest.TestCase):
+    """Тесты потокового анализа Excel файлов"""
+
+    def setUp(self):
+        """Создание Excel файла с пропущенными значениями"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=7, freq='MS'),
+            'Продукт_1': [100, np.nan, 300, 400, 500, 600, 700],
+            'Продукт_2': [200, 250, 150, np.nan, 400, 100, 300],
+        })
+        self.buffer = io.BytesIO()
+        self.df.to_excel(self.buffer, index=False)
+
+    def test_matches_in_memory_analysis(self):
+        """Тест совпадения потоковых итогов с результатами analyze_sales_data"""
+        self.buffer.seek(0)
+        aggregator, preview = analyze_sales_chunks(
+            iter_dataset_chunks(self.buffer, 'xlsx', chunk_rows=3))
+        streamed = aggregator.results()
+        expected, processed_df = analyze_sales_data(self.df.copy())
+
+        pd.testing.assert_series_equal(streamed['total_sales_per_product'],
+                                       expected['total_sales_per_product'],
+                                       check_dtype=False)
+        pd.testing.assert_series_equal(streamed['total_monthly_sales'],
+                                       expected['total_monthly_sales'],
+                                       check_dtype=False, check_names=False,
+                                       check_index_type=False, check_freq=False)
+        for stat in ['count', 'mean', 'min', 'max']:
+            pd.testing.assert_series_equal(streamed['basic_stats'].loc[stat],
+                                           expected['basic_stats'].loc[stat])
+        self.assertEqual(streamed['month_highest_sales'], expected['month_highest_sales'])
+        self.assertEqual(streamed['product_highest_sales'], expected['product_highest_sales'])
+
+        self.assertEqual(aggregator.n_rows, 7)
+        self.assertEqual(aggregator.missing_values, 2)
+        self.assertEqual(len(preview), 3)
+
+    def test_text_dates_in_named_column(self):
+        """Тест распознавания столбца «Период» с датами dd.mm.yyyy"""
+        df = pd.DataFrame({
+            'Период': ['01.01.2020', '01.02.2020', '01.03.2020'],
+            'Продукт_1': [100, 200, 300],
+        })
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        upload = MagicMock()
+        upload.name = 'sales.xlsx'
+        upload.getvalue.return_value = buffer.getvalue()
+
+        aggregator, _ = load_streamed_analysis(upload)
+        results = aggregator.results()
+
+        self.assertEqual(list(results['total_sales_per_product'].index), ['Продукт_1'])
+        self.assertEqual(results['month_highest_sales'], pd.Timestamp('2020-03-01'))
+        self.assertEqual(list(results['total_monthly_sales'].index),
+                         list(pd.date_range('2020-01-01', periods=3, freq='MS')))
+
+
+class TestColumnarFormats(unittest.TestCase):
+    """Тесты загрузки CSV, Parquet и Feather файлов"""
+
+    def setUp(self):
+        """Подготовка тестовых данных"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=4, freq='MS'),
+            'Продукт_1': [100, 200, 300, 400],
+            'Продукт_2': [50, 60, 70, 80],
+        })
+
+    def _check_loaded(self, loaded):
+        """Проверка анализа загруженных Arrow-данных"""
+        self.assertTrue(all(isinstance(dtype, pd.ArrowDtype) for dtype in loaded.dtypes))
+        results, processed_df = analyze_sales_data(loaded)
+        self.assertEqual(results['total_sales_per_product']['Продукт_1'], 1000)
+        self.assertEqual(results['product_highest_sales'], 'Продукт_1')
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(processed_df.index))
+
+    def test_csv(self):
+        """Тест чтения CSV через pyarrow"""
+        data = self.df.to_csv(index=False).encode('utf-8')
+        self._check_loaded(read_uploaded_bytes(data, 'sales.CSV'))
+
+    def test_parquet(self):
+        """Тест чтения Parquet"""
+        buffer = io.BytesIO()
+        self.df.to_parquet(buffer, index=False)
+        self._check_loaded(read_uploaded_bytes(buffer.getvalue(), 'sales.parquet'))
+
+    def test_feather(self):
+        """Тест чтения Feather"""
+        buffer = io.BytesIO()
+        self.df.to_feather(buffer)
+        self._check_loaded(read_uploaded_bytes(buffer.getvalue(), 'sales.feather'))
+
+    def test_analysis_does_not_modify_input(self):
+        """Тест того, что анализ не изменяет исходный DataFrame"""
+        original = self.df.copy()
+        analyze_sales_data(self.df)
+        pd.testing.assert_frame_equal(self.df, original)
+
+
+class TestMultiSheetWorkbooks(unittest.TestCase):
+    """Тесты загрузки книг Excel с несколькими листами"""
+
+    def setUp(self):
+        """Создание книги с листом на каждый регион"""
+        dates = pd.date_range('2020-01-01', periods=3, freq='MS')
+        self.sheets = {
+            'Север': pd.DataFrame({'Дата': dates, 'Продукт_1': [1, 2, 3], 'Продукт_2': [10, 20, 30]}),
+            'Юг': pd.DataFrame({'Дата': dates, 'Продукт_1': [4, 5, 6], 'Продукт_2': [40, 50, 60]}),
+            'Запад': pd.DataFrame({'Дата': dates, 'Продукт_1': [7, 8, 9], 'Продукт_2': [70, 80, 90]}),
+        }
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer) as writer:
+            for name, df in self.sheets.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+        self.data = buffer.getvalue()
+
+    def test_read_excel_sheets_parallel(self):
+        """Тест параллельного чтения всех листов"""
+        frames = read_excel_sheets(self.data, list(self.sheets), max_workers=3)
+
+        self.assertEqual(list(frames), list(self.sheets))
+        for name, df in self.sheets.items():
+            pd.testing.assert_frame_equal(frames[name], df, check_dtype=False)
+
+    def test_read_excel_sheets_progress_and_cancel(self):
+        """Тест прогресса по листам и отмены чтения в пуле процессов"""
+        progress = {}
+        read_excel_sheets(self.data, list(self.sheets), max_workers=3, progress=progress)
+        self.assertEqual(progress['sheets_done'], 3)
+
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with self.assertRaises(ParseCancelled):
+            read_excel_sheets(self.data, list(self.sheets), max_workers=3,
+                              cancel_event=cancel_event)
+
+    def test_combine_sheets(self):
+        """Тест объединения листов с суммированием по датам"""
+        combined = combine_sheets(self.sheets)
+
+        self.assertEqual(len(combined), 3)
+        self.assertEqual(list(combined['Продукт_1']), [12, 15, 18])
+        results, processed_df = analyze_sales_data(combined)
+        self.assertEqual(results['total_sales_per_product']['Продукт_2'], 450)
+
+    def test_load_excel_sheets_parses_only_missing(self):
+        """Тест повторной загрузки листов из кэша"""
+        upload = MagicMock()
+        upload.name = 'regions.xlsx'
+        upload.getvalue.return_value = self.data
+        cache = LRUCache(max_entries=10)
+
+        load_excel_sheets(upload, ['Север', 'Юг'], cache)
+        with patch('streamlit_app.read_excel_sheets', wraps=read_excel_sheets) as mock_read:
+            frames = load_excel_sheets(upload, ['Север', 'Юг', 'Запад'], cache)
+            mock_read.assert_called_once()
+            self.assertEqual(mock_read.call_args[0][1], ['Запад'])
+
+        self.assertEqual(list(frames['Запад']['Продукт_1']), [7, 8, 9])
+
+
+class TestDtypeOptimization(unittest.TestCase):
+    """Тесты компактного представления данных"""
+
+    def setUp(self):
+        """Подготовка данных с разными типами столбцов"""
+        self.df = pd.DataFrame({
+            'Дата': ['2020-01-01', '2020-02-01', '2020-03-01', '2020-04-01'],
+            'Продукт_1': np.array([1000, 1100, 1200, 1300], dtype=np.int64),
+            'Продукт_2': [100.5, 200.75, np.nan, 150.25],
+            'Продукт_3': [50.33, 75.67, 100.99, 10.01],
+            'Регион': ['Север', 'Север', 'Юг', 'Юг'],
+        })
+
+    def test_optimize_dtypes(self):
+        """Тест понижения разрядности и преобразования в категории"""
+        compact = optimize_dtypes(self.df)
+
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(compact['Дата']))
+        self.assertEqual(compact['Продукт_1'].dtype, np.int32)
+        self.assertEqual(compact['Продукт_2'].dtype, np.float32)
+        # Значения, не представимые в float32 без потерь, не изменяются
+        self.assertEqual(compact['Продукт_3'].dtype, np.float64)
+        self.assertIsInstance(compact['Регион'].dtype, pd.CategoricalDtype)
+        self.assertGreater(compact.attrs['original_memory'],
+                           compact.memory_usage(deep=True).sum())
+
+    def test_analysis_results_unchanged(self):
+        """Тест совпадения результатов анализа до и после оптимизации"""
+        expected, _ = analyze_sales_data(self.df)
+        actual, _ = analyze_sales_data(optimize_dtypes(self.df))
+
+        pd.testing.assert_series_equal(actual['total_sales_per_product'],
+                                       expected['total_sales_per_product'],
+                                       check_dtype=False)
+        self.assertNotIn('Регион', actual['total_sales_per_product'])
+
+    def test_arrow_columns(self):
+        """Тест оптимизации Arrow-столбцов"""
+        arrow_df = self.df.convert_dtypes(dtype_backend='pyarrow')
+        compact = optimize_dtypes(arrow_df)
+
+        self.assertEqual(str(compact['Продукт_1'].dtype), 'int32[pyarrow]')
+        self.assertEqual(list(compact['Продукт_1']), [1000, 1100, 1200, 1300])
+
+
+class TestIncrementalUpload(unittest.TestCase):
+    """Тесты пакетной загрузки с добавлением новых файлов"""
+
+    def setUp(self):
+        """Отдельное состояние сессии для каждого теста"""
+        self.session_state = {}
+        patcher = patch.object(streamlit_app.st, 'session_state', self.session_state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _make_upload(self, df, name):
+        """Создание объекта, имитирующего загруженный CSV файл"""
+        upload = MagicMock()
+        upload.name = name
+        upload.file_id = name
+        upload.getvalue.return_value = df.to_csv(index=False).encode('utf-8')
+        return upload
+
+    def _month(self, start, values):
+        """Данные за несколько месяцев"""
+        return pd.DataFrame({'Дата': pd.date_range(start, periods=len(values), freq='MS'),
+                             'Продукт_1': values})
+
+    def test_append_dataset_replaces_duplicate_dates(self):
+        """Тест замены повторяющихся дат строками из нового файла"""
+        existing = self._month('2020-01-01', [1, 2, 3])
+        new = self._month('2020-03-01', [30, 40])
+
+        combined = append_dataset(existing, new)
+
+        self.assertEqual(list(combined['Продукт_1']), [1, 2, 30, 40])
+        self.assertTrue(combined['Дата'].is_monotonic_increasing)
+
+    def test_long_format_overlapping_periods_are_added(self):
+        """Тест сложения периода, содержащего транзакции из двух файлов"""
+        def transactions(start, end):
+            dates = pd.date_range(start, end, freq='D')
+            return pd.DataFrame({'Дата': dates.strftime('%Y-%m-%d'),
+                                 'Продукт': 'A', 'Сумма': 10})
+
+        january = self._make_upload(transactions('2020-01-01', '2020-01-31'), 'jan.csv')
+        february = self._make_upload(transactions('2020-02-01', '2020-02-29'), 'feb.csv')
+        options = ('Дата', 'Продукт', 'Сумма', 'W')
+
+        self.session_state['uploaded_data'] = ingest_uploaded_files([january],
+                                                                    long_options=options)
+        data = ingest_uploaded_files([january, february], long_options=options)
+
+        weekly = data.set_index('Дата')['A']
+        self.assertEqual(weekly[pd.Timestamp('2020-01-27')], 70)
+        self.assertEqual(weekly.sum(), 600)
+        self.assertTrue(data['Дата'].is_monotonic_increasing)
+
+    def test_only_new_files_are_loaded(self):
+        """Тест разбора только новых файлов при добавлении"""
+        january = self._make_upload(self._month('2020-01-01', [1]), 'jan.csv')
+        february = self._make_upload(self._month('2020-02-01', [2]), 'feb.csv')
+
+        data = ingest_uploaded_files([january])
+        self.session_state['uploaded_data'] = data
+
+        with patch('streamlit_app.load_wide_data', wraps=streamlit_app.load_wide_data) as mock_load:
+            data = ingest_uploaded_files([january, february])
+            self.assertEqual(mock_load.call_count, 1)
+            self.assertIs(mock_load.call_args[0][0], february)
+
+        self.assertEqual(list(data['Продукт_1']), [1, 2])
+
+    def test_removed_file_rebuilds_dataset(self):
+        """Тест пересборки набора данных после удаления файла из списка"""
+        january = self._make_upload(self._month('2020-01-01', [1]), 'jan.csv')
+        february = self._make_upload(self._month('2020-02-01', [2]), 'feb.csv')
+
+        self.session_state['uploaded_data'] = ingest_uploaded_files([january, february])
+        data = ingest_uploaded_files([february])
+
+        self.assertEqual(list(data['Продукт_1']), [2])
+
+    def test_new_months_update_session_aggregator(self):
+        """Тест учета новых месяцев в агрегаторе сессии без пересчета набора"""
+        first = self._make_upload(self._month('2020-01-01', [1, 5, 3]), 'q1.csv')
+        second = self._make_upload(self._month('2020-04-01', [7, 2]), 'q2.csv')
+
+        self.session_state['uploaded_data'] = ingest_uploaded_files([first])
+        aggregator = self.session_state['session_aggregator']
+        with patch.object(SalesAggregator, 'from_frame') as mock_from_frame:
+            data = ingest_uploaded_files([first, second])
+            mock_from_frame.assert_not_called()
+        self.assertEqual(aggregator.n_rows, 3)
+        aggregator = self.session_state['session_aggregator']
+        self.assertEqual(aggregator.n_rows, 5)
+
+        expected, _ = analyze_sales_data(data)
+        expected_stats = expected['basic_stats']
+        results, _ = session_analysis(data, aggregator=aggregator)
+        with patch('streamlit_app.parallel_sales_statistics') as mock_statistics:
+            pd.testing.assert_frame_equal(results['basic_stats'], expected_stats)
+            mock_statistics.assert_not_called()
+        pd.testing.assert_series_equal(results['total_monthly_sales'],
+                                       expected['total_monthly_sales'], check_dtype=False)
+
+    def test_overlapping_months_rebuild_aggregator(self):
+        """Тест пересборки агрегатора, если новый файл заменяет учтенные даты"""
+        first = self._make_upload(self._month('2020-01-01', [1, 2, 3]), 'q1.csv')
+        update = self._make_upload(self._month('2020-03-01', [30, 40]), 'fix.csv')
+
+        self.session_state['uploaded_data'] = ingest_uploaded_files([first])
+        ingest_uploaded_files([first, update])
+        aggregator = self.session_state['session_aggregator']
+
+        self.assertEqual(aggregator.n_rows, 4)
+        self.assertEqual(aggregator.totals[0], 1 + 2 + 30 + 40)
+
+    def test_failed_file_keeps_earlier_files(self):
+        """Тест сохранения файлов, добавленных до ошибки в середине пакета"""
+        january = self._make_upload(self._month('2020-01-01', [1]), 'jan.csv')
+        february = self._make_upload(self._month('2020-02-01', [2]), 'feb.csv')
+        broken = MagicMock()
+        broken.name = 'bad.parquet'
+        broken.file_id = 'bad.parquet'
+        broken.getvalue.return_value = b'not parquet'
+
+        self.session_state['uploaded_data'] = ingest_uploaded_files([january])
+        aggregator = self.session_state['session_aggregator']
+        with self.assertRaises(Exception):
+            ingest_uploaded_files([january, february, broken])
+
+        self.assertEqual(aggregator.n_rows, 1)
+        self.assertEqual(list(self.session_state['uploaded_data']['Продукт_1']), [1, 2])
+        data = ingest_uploaded_files([january, february])
+        self.assertEqual(list(data['Продукт_1']), [1, 2])
+        self.assertEqual(self.session_state['session_aggregator'].n_rows, 2)
+
+
+class TestBackgroundParsing(unittest.TestCase):
+    """Тесты фонового разбора Excel файлов"""
+
+    def setUp(self):
+        """Создание Excel файла"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=2500, freq='D'),
+            'Продукт_1': np.arange(2500),
+            'Продукт_2': np.arange(2500) * 0.5,
+        })
+        buffer = io.BytesIO()
+        self.df.to_excel(buffer, index=False)
+        self.data = buffer.getvalue()
+
+    def test_read_excel_rows_matches_read_excel(self):
+        """Тест совпадения построчного чтения с pd.read_excel"""
+        progress = {}
+        loaded = read_excel_rows(self.data, progress)
+
+        pd.testing.assert_frame_equal(loaded, pd.read_excel(io.BytesIO(self.data)),
+                                      check_dtype=False)
+        self.assertEqual(progress['rows'], 2500)
+        self.assertEqual(progress['total_rows'], 2500)
+
+    def test_read_excel_rows_matches_read_excel_headers(self):
+        """Тест повторяющихся и числовых заголовков и пустых строк как у pd.read_excel"""
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Дата', 'Продукт', 'Продукт', 2021, None, 'Продукт.1'])
+        sheet.append(['2020-01-01', 1, 2, 3, 4, 5])
+        sheet.append([None] * 6)
+        sheet.append(['2020-03-01', 1, None, 3, 4, 5])
+        sheet.append([None] * 6)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+
+        loaded = read_excel_rows(buffer.getvalue())
+        expected = pd.read_excel(io.BytesIO(buffer.getvalue()))
+
+        self.assertEqual(list(loaded.columns),
+                         ['Дата', 'Продукт', 'Продукт.2', 2021, 'Unnamed: 4', 'Продукт.1'])
+        pd.testing.assert_frame_equal(loaded, expected)
+
+    def test_cancelled_parse(self):
+        """Тест отмены разбора"""
+        cancel_event = threading.Event()
+        cancel_event.set()
+
+        with self.assertRaises(ParseCancelled):
+            read_excel_rows(self.data, {}, cancel_event)
+
+    def test_parse_job(self):
+        """Тест завершения фонового задания"""
+        job = ParseJob(self.data)
+        job.wait(timeout=60)
+
+        self.assertTrue(job.done)
+        self.assertIsNone(job.error)
+        self.assertEqual(job.fraction, 1.0)
+        self.assertEqual(len(job.result), 2500)
+
+    def test_parse_job_sheets(self):
+        """Тест фонового разбора нескольких листов с прогрессом по листам"""
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer) as writer:
+            self.df.to_excel(writer, sheet_name='Север', index=False)
+            self.df.head(10).to_excel(writer, sheet_name='Юг', index=False)
+
+        job = ParseJob(buffer.getvalue(), ['Север', 'Юг'])
+        job.wait(timeout=60)
+
+        self.assertIsNone(job.error)
+        self.assertEqual(job.progress['sheets_done'], 2)
+        self.assertEqual(job.fraction, 1.0)
+        self.assertEqual({name: len(df) for name, df in job.result.items()},
+                         {'Север': 2500, 'Юг': 10})
+
+    def _run_job(self, upload, key):
+        """Вызов фонового разбора до завершения задания"""
+        try:
+            return streamlit_app._parse_in_background(upload, key)
+        except streamlit_app.ParsePending as pending:
+            pending.job.wait(timeout=60)
+        return streamlit_app._parse_in_background(upload, key)
+
+    def test_job_lifecycle(self):
+        """Тест удаления заданий после ошибки и для убранных из списка файлов"""
+        upload = MagicMock()
+        upload.name = 'big.xlsx'
+        upload.file_id = 'big'
+        upload.getvalue.return_value = self.data
+        broken = MagicMock()
+        broken.name = 'broken.xlsx'
+        broken.file_id = 'broken'
+        broken.getvalue.return_value = b'not a workbook'
+
+        with patch.object(streamlit_app.st, 'session_state', {}) as session_state:
+            key = streamlit_app.uploaded_file_key(upload)
+            self.assertEqual(len(self._run_job(upload, key)), 2500)
+            self.assertEqual(session_state['parse_jobs'], {})
+
+            broken_key = streamlit_app.uploaded_file_key(broken)
+            with self.assertRaises(Exception):
+                self._run_job(broken, broken_key)
+            self.assertNotIn(broken_key, session_state['parse_jobs'])
+
+            # Отмененное задание живет, пока файл в списке, и удаляется вместе с файлом
+            job = session_state['parse_jobs'][key] = ParseJob(self.data)
+            job.cancel()
+            job.wait(timeout=60)
+            with self.assertRaises(ParseCancelled):
+                streamlit_app._parse_in_background(upload, key)
+            streamlit_app.prune_parse_jobs([upload])
+            self.assertIn(key, session_state['parse_jobs'])
+
+            streamlit_app.prune_parse_jobs([])
+            self.assertEqual(session_state['parse_jobs'], {})
+            self.assertEqual(len(self._run_job(upload, key)), 2500)
+
+
+class TestStatisticsKernel(unittest.TestCase):
+    """Тесты векторного расчета статистик"""
+
+    def test_matches_pandas(self):
+        """Тест совпадения с describe(), sum() и mean()"""
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame(rng.normal(1000, 200, size=(60, 5)),
+                          columns=[f'Продукт {i}' for i in range(5)])
+        df.iloc[3, 1] = np.nan
+        df.iloc[:, 4] = np.nan
+
+        stats, totals, row_totals = compute_sales_statistics(df.to_numpy())
+
+        expected = df.describe()
+        for name in expected.index:
+            np.testing.assert_allclose(stats[name], expected.loc[name].to_numpy())
+        np.testing.assert_allclose(totals, df.sum().to_numpy())
+        np.testing.assert_allclose(row_totals, df.sum(axis=1).to_numpy())
+
+    def test_integer_totals(self):
+        """Тест точных целочисленных сумм в результатах анализа"""
+        df = pd.DataFrame({'A': [2**40, 3, 5], 'B': [1, 2, 3]})
+        results, _ = analyze_sales_data(df)
+
+        pd.testing.assert_series_equal(results['total_sales_per_product'], df.sum())
+        pd.testing.assert_series_equal(results['total_monthly_sales'], df.sum(axis=1))
+        pd.testing.assert_frame_equal(results['basic_stats'], df.describe())
+
+    def test_single_row(self):
+        """Тест одной строки: стандартное отклонение не определено"""
+        stats, _, _ = compute_sales_statistics(np.array([[1.0, 2.0]]))
+
+        self.assertTrue(np.isnan(stats['std']).all())
+        np.testing.assert_array_equal(stats['50%'], [1.0, 2.0])
+
+
+class TestIncrementalStatistics(unittest.TestCase):
+    """Тесты инкрементального обновления статистик"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(7)
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=36, freq='MS'),
+            'Продукт_1': rng.normal(1000, 100, 36),
+            'Продукт_2': rng.normal(1500, 300, 36),
+        })
+        self.df.loc[5, 'Продукт_2'] = np.nan
+
+    def test_append_matches_full_analysis(self):
+        """Тест совпадения дописанных блоков с полным расчетом"""
+        aggregator = SalesAggregator.from_frame(self.df.iloc[:12])
+        aggregator.append(self.df.iloc[12:30])
+        aggregator.append(self.df.iloc[30:])
+
+        results = aggregator.results()
+        expected, _ = analyze_sales_data(self.df)
+
+        for name in ['count', 'mean', 'std', 'min', 'max']:
+            np.testing.assert_allclose(results['basic_stats'].loc[name],
+                                       expected['basic_stats'].loc[name])
+        np.testing.assert_allclose(results['total_sales_per_product'],
+                                   expected['total_sales_per_product'])
+        self.assertEqual(results['month_highest_sales'], expected['month_highest_sales'])
+        self.assertEqual(results['product_highest_sales'], expected['product_highest_sales'])
+
+    def test_results_refresh_after_append(self):
+        """Тест обновления результатов после добавления строк"""
+        aggregator = SalesAggregator.from_frame(self.df.iloc[:12])
+        first = aggregator.results()
+        self.assertIs(aggregator.results(), first)
+
+        aggregator.append(self.df.iloc[12:])
+        self.assertEqual(aggregator.results()['basic_stats'].loc['count', 'Продукт_1'], 36)
+
+    def test_append_missing_columns(self):
+        """Тест ошибки при отсутствии столбцов продуктов"""
+        aggregator = SalesAggregator.from_frame(self.df)
+
+        with self.assertRaises(ValueError):
+            aggregator.append(self.df.drop(columns='Продукт_2'))
+
+    def test_period_memory_per_row(self):
+        """Тест памяти агрегатора: метки периодов хранятся массивами, а не объектами"""
+        n_rows = 200_000
+        df = pd.DataFrame({'Дата': pd.date_range('2000-01-01', periods=n_rows, freq='min'),
+                           'Продукт_1': np.ones(n_rows), 'Продукт_2': np.ones(n_rows)})
+
+        tracemalloc.start()
+        try:
+            aggregator = SalesAggregator.from_frame(df.iloc[:100_000])
+            aggregator.append(df.iloc[100_000:])
+            held, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(held, 40 * n_rows)
+        self.assertLessEqual(aggregator.nbytes, held)
+        results = aggregator.results()
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(results['total_monthly_sales'].index))
+        self.assertIsInstance(results['month_highest_sales'], pd.Timestamp)
+
+
+class TestCorrelationMatrix(unittest.TestCase):
+    """Тесты общей корреляционной матрицы"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(3)
+        self.df = pd.DataFrame(rng.normal(size=(50, 4)), columns=list('ABCD'))
+
+    def test_matches_pandas(self):
+        """Тест совпадения с DataFrame.corr() с пропусками и без"""
+        pd.testing.assert_frame_equal(compute_correlation_matrix(self.df), self.df.corr())
+
+        with_gaps = self.df.copy()
+        with_gaps.iloc[::7, 2] = np.nan
+        pd.testing.assert_frame_equal(compute_correlation_matrix(with_gaps), with_gaps.corr())
+
+    def test_cached_by_fingerprint(self):
+        """Тест повторного использования матрицы для той же версии данных"""
+        cache = LRUCache(max_entries=4)
+        first = compute_correlation_matrix(self.df, cache)
+
+        self.assertIs(compute_correlation_matrix(self.df.copy(), cache), first)
+
+        changed = self.df.copy()
+        changed.iloc[0, 0] += 1
+        self.assertNotEqual(dataset_fingerprint(changed), dataset_fingerprint(self.df))
+        self.assertIsNot(compute_correlation_matrix(changed, cache), first)
+
+    def test_stored_in_results(self):
+        """Тест сохранения матрицы в результатах анализа"""
+        results, processed_df = analyze_sales_data(self.df)
+
+        pd.testing.assert_frame_equal(results['correlation_matrix'], processed_df.corr())
+
+
+class TestLazyMetrics(unittest.TestCase):
+    """Тесты реестра метрик с вычислением по требованию"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=6, freq='MS'),
+            'A': [1, 5, 2, 8, 3, 4],
+            'B': [2, 2, 9, 1, 1, 1],
+        })
+
+    def test_only_requested_metrics_computed(self):
+        """Тест расчета только запрошенной метрики и ее зависимостей"""
+        results, _ = analyze_sales_data(self.df)
+        self.assertEqual(results.computed, set())
+
+        self.assertEqual(results['month_highest_sales'], pd.Timestamp('2020-03-01'))
+        self.assertEqual(results.computed,
+                         {'_statistics', 'total_monthly_sales', 'month_highest_sales'})
+        self.assertNotIn('correlation_matrix', results.computed)
+
+    def test_keys_cover_registry(self):
+        """Тест ключей результатов: все публичные метрики без служебных"""
+        results, _ = analyze_sales_data(self.df)
+
+        self.assertEqual(set(results), {name for name in METRICS if not name.startswith('_')})
+        self.assertNotIn('_statistics', results)
+        self.assertIsNone(results.get('unknown_metric'))
+
+    def test_custom_metric(self):
+        """Тест добавления метрики с зависимостью"""
+        metrics = dict(METRICS)
+        calls = []
+
+        def share_of_best(results, totals, best):
+            calls.append(best)
+            return totals[best] / totals.sum()
+
+        metrics['best_share'] = (('total_sales_per_product', 'product_highest_sales'),
+                                 share_of_best)
+        results = LazyResults(self.df.set_index('Дата'), metrics=metrics)
+
+        self.assertAlmostEqual(results['best_share'], 23 / 39)
+        self.assertAlmostEqual(results['best_share'], 23 / 39)
+        self.assertEqual(calls, ['A'])
+
+
+class TestTimeRollups(unittest.TestCase):
+    """Тесты сводок продаж по периодам"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(5)
+        dates = pd.date_range('2021-01-01', periods=800, freq='D')
+        self.df = pd.DataFrame(rng.integers(0, 100, size=(800, 3)).astype(float),
+                               index=dates, columns=['A', 'B', 'C'])
+        self.df.iloc[10, 1] = np.nan
+        # Строки в произвольном порядке и повтор дня
+        self.df = pd.concat([self.df, self.df.iloc[[3]]]).sample(frac=1, random_state=0)
+
+    def test_levels_match_resample(self):
+        """Тест совпадения уровней с resample() по исходным строкам"""
+        cube = TimeRollupCube(self.df)
+
+        for freq, rule in [('D', 'D'), ('W', 'W-SUN'), ('M', 'MS'), ('Q', 'QS'), ('Y', 'YS')]:
+            expected = self.df.resample(rule).sum()
+            actual = cube.frame(freq)
+            if freq == 'W':
+                # resample помечает неделю воскресеньем, сводка - понедельником
+                expected.index = expected.index - pd.Timedelta(days=6)
+            expected = expected[expected.index.isin(actual.index)]
+            expected.index = expected.index.as_unit('ns')
+            pd.testing.assert_frame_equal(actual, expected, check_freq=False,
+                                          check_names=False, check_dtype=False)
+
+    def test_built_from_finer_level(self):
+        """Тест построения уровня из предыдущего без обращения к строкам"""
+        cube = TimeRollupCube(self.df)
+        cube.level('Y')
+
+        self.assertEqual(set(cube._levels), {'D', 'M', 'Q', 'Y'})
+
+    def test_available_in_results(self):
+        """Тест сводки в результатах анализа только для дат"""
+        results, _ = analyze_sales_data(self.df.reset_index(names='Дата'))
+        self.assertEqual(results['time_rollups'].totals('Y').sum(),
+                         self.df.sum().sum())
+
+        results, _ = analyze_sales_data(self.df.reset_index(drop=True))
+        self.assertIsNone(results['time_rollups'])
+
+
+class TestGrowthMetrics(unittest.TestCase):
+    """Тесты скользящих средних, роста и тренда"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(11)
+        self.values = pd.DataFrame(rng.normal(100, 20, size=(30, 4)))
+        self.values.iloc[7, 2] = np.nan
+
+    def test_rolling_mean_matches_pandas(self):
+        """Тест совпадения с rolling(window).mean()"""
+        expected = self.values.rolling(3).mean().to_numpy()
+
+        np.testing.assert_allclose(rolling_mean(self.values.to_numpy(), 3), expected)
+        self.assertTrue(np.isnan(rolling_mean(self.values.to_numpy()[:2], 3)).all())
+
+    def test_growth_matches_pandas(self):
+        """Тест совпадения с pct_change()"""
+        for lag in (1, 12):
+            expected = self.values.pct_change(lag, fill_method=None).to_numpy()
+            np.testing.assert_allclose(period_growth(self.values.to_numpy(), lag), expected)
+
+    def test_trend_slopes(self):
+        """Тест наклона тренда с пропусками и без"""
+        x = np.arange(10, dtype=float)
+        values = np.column_stack([2 * x + 1, -x, np.full(10, 5.0)])
+        values[3, 1] = np.nan
+
+        np.testing.assert_allclose(trend_slopes(values), [2.0, -1.0, 0.0], atol=1e-12)
+
+    def test_monthly_metrics_in_results(self):
+        """Тест метрик по непрерывному ряду месяцев"""
+        df = pd.DataFrame({
+            'Дата': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-04-01']),
+            'A': [100, 110, 121],
+        })
+        results, _ = analyze_sales_data(df)
+
+        self.assertEqual(len(results['monthly_sales']), 4)
+        self.assertAlmostEqual(results['mom_growth']['A'].iloc[1], 0.1)
+        self.assertTrue(np.isnan(results['mom_growth']['A'].iloc[3]))
+        self.assertEqual(results['cumulative_sales']['A'].iloc[-1], 331)
+        self.assertGreater(results['total_sales_trend'], 0)
+
+
+class TestTopK(unittest.TestCase):
+    """Тесты рейтингов продуктов и периодов"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(2)
+        self.series = pd.Series(rng.integers(0, 50, 500).astype(float),
+                                index=[f'SKU_{i}' for i in range(500)])
+        self.series.iloc[::37] = np.nan
+
+    def test_matches_nlargest(self):
+        """Тест совпадения с nlargest/nsmallest, включая равные значения"""
+        for k in (0, 1, 3, 10, 100, 400):
+            pd.testing.assert_series_equal(top_k(self.series, k), self.series.nlargest(k))
+            pd.testing.assert_series_equal(top_k(self.series, k, largest=False),
+                                           self.series.nsmallest(k))
+
+    def test_streaming_matches_full_selection(self):
+        """Тест кучи по блокам против отбора по всему ряду"""
+        values = self.series.fillna(-1)
+        ranking = StreamingTopK(10)
+        for start in range(0, len(values), 64):
+            block = values.iloc[start:start + 64]
+            ranking.push(block.index, block.to_numpy())
+
+        pd.testing.assert_series_equal(ranking.result(), top_k(values, 10))
+
+    def test_top_periods_in_streaming_results(self):
+        """Тест лучших периодов в результатах агрегатора"""
+        df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=24, freq='MS'),
+            'A': np.arange(24) % 7,
+            'B': np.arange(24) % 5,
+        })
+        aggregator = SalesAggregator.from_frame(df.iloc[:10])
+        aggregator.append(df.iloc[10:])
+        expected, _ = analyze_sales_data(df)
+
+        pd.testing.assert_series_equal(aggregator.results()['top_periods'].head(5),
+                                       expected['top_periods'].head(5), check_index_type=False,
+                                       check_names=False, check_dtype=False)
+
+
+class TestChunkedAnalysis(unittest.TestCase):
+    """Тесты анализа файлов, читаемых порциями"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(4)
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2000-01-01', periods=300, freq='D'),
+            'Продукт_1': rng.integers(100, 1000, 300),
+            'Продукт_2': rng.normal(500, 50, 300),
+        })
+
+    def _encoded(self, extension):
+        """Содержимое файла с тестовыми данными в заданном формате"""
+        buffer = io.BytesIO()
+        if extension == 'csv':
+            self.df.to_csv(buffer, index=False)
+        elif extension == 'parquet':
+            self.df.to_parquet(buffer, index=False)
+        elif extension == 'feather':
+            self.df.to_feather(buffer)
+        else:
+            self.df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+    def test_csv_type_changes_in_later_block(self):
+        """Тест CSV, где дробные значения появляются только в следующих блоках"""
+        self.df['Продукт_1'] = self.df['Продукт_1'].astype(object)
+        self.df.loc[250, 'Продукт_1'] = 12.5
+        expected = self.df['Продукт_1'].sum()
+
+        with patch.object(streamlit_app, 'CSV_CHUNK_BYTES', 2048):
+            aggregator, _ = analyze_sales_chunks(
+                iter_dataset_chunks(io.BytesIO(self._encoded('csv')), 'csv'))
+
+        self.assertEqual(aggregator.n_rows, 300)
+        self.assertAlmostEqual(aggregator.results()['total_sales_per_product']['Продукт_1'],
+                               expected)
+
+    def test_chunks_cover_all_rows(self):
+        """Тест чтения всех форматов порциями"""
+        for extension in ('csv', 'parquet', 'feather', 'xlsx'):
+            with self.subTest(extension=extension), \
+                    patch.object(streamlit_app, 'CSV_CHUNK_BYTES', 2048):
+                chunks = list(iter_dataset_chunks(io.BytesIO(self._encoded(extension)),
+                                                  extension, chunk_rows=64))
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual(sum(len(chunk) for chunk in chunks), len(self.df))
+
+    def test_matches_full_analysis(self):
+        """Тест совпадения итогов по порциям с анализом всей таблицы"""
+        expected, _ = analyze_sales_data(self.df)
+
+        for extension in ('parquet', 'xlsx'):
+            with self.subTest(extension=extension):
+                aggregator, preview = analyze_sales_chunks(
+                    iter_dataset_chunks(io.BytesIO(self._encoded(extension)), extension,
+                                        chunk_rows=64))
+                results = aggregator.results()
+
+                self.assertEqual(aggregator.n_rows, 300)
+                self.assertEqual(len(preview), 5)
+                for name in ['count', 'mean', 'std', 'min', 'max']:
+                    np.testing.assert_allclose(results['basic_stats'].loc[name],
+                                               expected['basic_stats'].loc[name])
+                self.assertEqual(results['month_highest_sales'],
+                                 expected['month_highest_sales'])
+
+    def test_long_chunks_match_pivot(self):
+        """Тест сведения транзакций по порциям"""
+        rng = np.random.default_rng(8)
+        transactions = pd.DataFrame({
+            'Дата': pd.to_datetime('2021-01-01') + pd.to_timedelta(
+                rng.integers(0, 400, 2000), unit='D'),
+            'Продукт': rng.choice(['A', 'B', 'C'], 2000),
+            'Сумма': rng.integers(1, 100, 2000),
+        })
+        chunks = (transactions.iloc[start:start + 300] for start in range(0, 2000, 300))
+
+        wide = pivot_long_chunks(chunks, 'Дата', 'Продукт', 'Сумма')
+        expected = pivot_long_sales(transactions, 'Дата', 'Продукт', 'Сумма')
+
+        pd.testing.assert_frame_equal(wide, expected, check_dtype=False, check_freq=False)
+
+
+class TestQuantileSketch(unittest.TestCase):
+    """Тесты приближенных квантилей"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(9)
+        self.values = rng.lognormal(6, 1, size=(40000, 3))
+        self.values[::11, 2] = np.nan
+
+    def _assert_within_bound(self, sketch, values):
+        """Проверка, что ранги оценок не выходят за границу ошибки"""
+        estimates = sketch.quantiles()
+        bounds = sketch.error_bound()
+        for column in range(values.shape[1]):
+            present = np.sort(values[:, column][~np.isnan(values[:, column])])
+            low = np.searchsorted(present, estimates[:, column], side='left') / present.size
+            high = np.searchsorted(present, estimates[:, column], side='right') / present.size
+            for q, lo, hi in zip((0.25, 0.5, 0.75), low, high):
+                self.assertLessEqual(lo, q + bounds[column] + 1 / present.size)
+                self.assertGreaterEqual(hi, q - bounds[column] - 1 / present.size)
+
+    def test_bounded_error_and_memory(self):
+        """Тест ошибки в пределах границы и ограниченной памяти"""
+        sketch = QuantileSketch(3, k=128)
+        for start in range(0, len(self.values), 1000):
+            sketch.update(self.values[start:start + 1000])
+
+        self.assertGreater(sketch.rank_error, 0)
+        self.assertLess(sum(level.shape[0] for level in sketch.levels), 128 * 2 * 10)
+        self.assertTrue((sketch.error_bound() < 0.05).all())
+        self._assert_within_bound(sketch, self.values)
+
+    def test_merge_of_parts(self):
+        """Тест слияния эскизов частей данных"""
+        parts = [QuantileSketch(3, k=128) for _ in range(4)]
+        for i, part in enumerate(parts):
+            part.update(self.values[i::4])
+        merged = parts[0]
+        for part in parts[1:]:
+            merged.merge(part)
+
+        np.testing.assert_array_equal(merged.counts, (~np.isnan(self.values)).sum(axis=0))
+        self._assert_within_bound(merged, self.values)
+
+    def test_exact_without_compaction(self):
+        """Тест точных квартилей для небольших данных"""
+        sketch = QuantileSketch(3)
+        sketch.update(self.values[:100])
+
+        np.testing.assert_allclose(sketch.quantiles(),
+                                   np.nanquantile(self.values[:100], [0.25, 0.5, 0.75], axis=0))
+        np.testing.assert_array_equal(sketch.error_bound(), 0)
+
+    def test_approximate_analysis(self):
+        """Тест строки границы ошибки в описательной статистике"""
+        df = pd.DataFrame(self.values, columns=['A', 'B', 'C'])
+        exact, _ = analyze_sales_data(df)
+        approximate, _ = analyze_sales_data(df, approximate=True)
+
+        self.assertIn('rank_error', approximate['basic_stats'].index)
+        self.assertNotIn('rank_error', exact['basic_stats'].index)
+        pd.testing.assert_frame_equal(approximate['basic_stats'].loc[['count', 'mean', 'max']],
+                                      exact['basic_stats'].loc[['count', 'mean', 'max']])
+
+
+class TestParallelStatistics(unittest.TestCase):
+    """Тесты расчета статистик блоками столбцов в пуле процессов"""
+
+    def test_matches_single_process(self):
+        """Тест совпадения с расчетом в одном процессе"""
+        rng = np.random.default_rng(12)
+        values = rng.normal(100, 10, size=(300, 50))
+        values[::9, 7] = np.nan
+
+        expected = compute_sales_statistics(values)
+        with patch.object(streamlit_app, 'PARALLEL_MIN_COLUMNS', 10), \
+                patch.object(streamlit_app, 'PARALLEL_MIN_CELLS', 0):
+            stats, totals, row_totals = parallel_sales_statistics(values, max_workers=3)
+
+        for name, column_values in expected[0].items():
+            np.testing.assert_allclose(stats[name], column_values)
+        np.testing.assert_allclose(totals, expected[1])
+        np.testing.assert_allclose(row_totals, expected[2])
+
+    def test_pool_timeout_falls_back(self):
+        """Тест расчета в текущем процессе, если пул не уложился в срок"""
+        values = np.arange(600, dtype=np.float64).reshape(20, 30)
+
+        expected = compute_sales_statistics(values)
+        with patch.object(streamlit_app, 'PARALLEL_MIN_COLUMNS', 10), \
+                patch.object(streamlit_app, 'PARALLEL_MIN_CELLS', 0), \
+                patch.object(streamlit_app, 'POOL_TIMEOUT_SECONDS', 0):
+            stats, totals, _ = parallel_sales_statistics(values, max_workers=3)
+
+        np.testing.assert_allclose(stats['mean'], expected[0]['mean'])
+        np.testing.assert_allclose(totals, expected[1])
+
+    def test_approximate_sketches_in_workers(self):
+        """Тест эскизов квартилей в процессах пула: те же оценки, что и в одном процессе"""
+        rng = np.random.default_rng(14)
+        values = rng.gamma(2.0, 50.0, size=(3000, 40))
+        values[::11, 3] = np.nan
+
+        expected = sketch_sales_statistics(values)
+        with patch.object(streamlit_app, 'PARALLEL_MIN_COLUMNS', 10), \
+                patch.object(streamlit_app, 'PARALLEL_MIN_CELLS', 0), \
+                patch.object(streamlit_app, 'sketch_sales_statistics',
+                             side_effect=AssertionError('эскиз в текущем процессе')):
+            stats, totals, _ = parallel_sales_statistics(values, quantiles=False,
+                                                         max_workers=3, approximate=True)
+
+        for name in ('25%', '50%', '75%', 'rank_error', 'mean'):
+            np.testing.assert_allclose(stats[name], expected[0][name])
+        np.testing.assert_allclose(totals, expected[1])
+
+
+class TestLineDownsampling(unittest.TestCase):
+    """Тесты прореживания ряда для линейного графика"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        rng = np.random.default_rng(13)
+        values = np.cumsum(rng.normal(size=20000)) + 1000
+        values[12345] = 5000
+        values[777] = -5000
+        self.series = pd.Series(values, index=pd.date_range('1970-01-01', periods=20000))
+
+    def test_keeps_shape(self):
+        """Тест сохранения краев, пиков и порядка точек"""
+        sampled = downsample_series(self.series, max_points=500)
+
+        self.assertEqual(len(sampled), 500)
+        self.assertTrue(sampled.index.is_monotonic_increasing)
+        self.assertEqual(sampled.index[0], self.series.index[0])
+        self.assertEqual(sampled.index[-1], self.series.index[-1])
+        self.assertEqual(sampled.max(), 5000)
+        self.assertEqual(sampled.min(), -5000)
+
+    def test_short_series_unchanged(self):
+        """Тест короткого ряда без прореживания"""
+        short = self.series.iloc[:100]
+
+        self.assertIs(downsample_series(short, max_points=500), short)
+        np.testing.assert_array_equal(lttb_indices(np.arange(3), np.arange(3), 10), [0, 1, 2])
+
+    def test_chart_point_budget(self):
+        """Тест числа точек на графике общих продаж"""
+        df = self.series.to_frame('Продукт').reset_index(names='Дата')
+        results, processed_df = analyze_sales_data(df)
+        fig1, fig2, fig3 = create_visualizations(processed_df, results)
+
+        line = fig1.axes[0].get_lines()[0]
+        self.assertEqual(len(line.get_xdata()), streamlit_app.LINE_CHART_MAX_POINTS)
+        self.assertEqual(line.get_marker(), 'None')
+        plt.close('all')
+
+
+class TestChartCache(unittest.TestCase):
+    """Тесты кэша растеризованных графиков"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=24, freq='MS'),
+            'A': np.arange(24) * 3,
+            'B': np.arange(24) % 5,
+        })
+
+    def test_png_reused_for_same_data(self):
+        """Тест повторного использования PNG для тех же данных и параметров"""
+        cache = LRUCache(max_entries=8)
+        builds = []
+
+        def build(results):
+            builds.append(1)
+            return create_sales_trend_figure(results)
+
+        for _ in range(2):
+            results, _ = analyze_sales_data(self.df, LRUCache(max_entries=8))
+            key = (results_fingerprint(results), 'trend', None)
+            png = cached_chart_png(cache, key, lambda: build(results))
+
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertEqual(len(builds), 1)
+
+        changed = self.df.assign(A=self.df['A'] + 1)
+        results, _ = analyze_sales_data(changed, LRUCache(max_entries=8))
+        cached_chart_png(cache, (results_fingerprint(results), 'trend', None),
+                         lambda: build(results))
+        self.assertEqual(len(builds), 2)
+
+    def test_streaming_results_not_cached(self):
+        """Тест графиков потоковых итогов без ключа кэша"""
+        results = SalesAggregator.from_frame(self.df).results()
+
+        self.assertIsNone(results_fingerprint(results))
+        self.assertIsNone(cached_chart_png(LRUCache(max_entries=2), None, lambda: None))
+
+
+class TestCorrelationView(unittest.TestCase):
+    """Тесты карты корреляций для больших каталогов"""
+
+    def setUp(self):
+        """Подготовка данных для тестов: 5 групп связанных продуктов"""
+        rng = np.random.default_rng(14)
+        base = rng.normal(size=(120, 5))
+        columns = [base[:, i % 5] + rng.normal(scale=0.5, size=120) for i in range(100)]
+        self.df = pd.DataFrame(np.column_stack(columns),
+                               columns=[f'SKU_{i}' for i in range(100)])
+
+    def test_order_groups_related_products(self):
+        """Тест упорядочивания: каждая группа - один непрерывный блок"""
+        order = correlation_order(self.df.corr())
+
+        self.assertEqual(sorted(order), list(range(100)))
+        self.assertEqual(int((np.diff(order % 5) != 0).sum()), 4)
+
+    def test_top_pairs(self):
+        """Тест таблицы пар с наибольшей по модулю корреляцией"""
+        correlation = self.df.corr()
+        pairs = top_correlated_pairs(correlation, k=5)
+
+        values = correlation.to_numpy()
+        expected = np.sort(np.abs(values[np.triu_indices_from(values, k=1)]))[::-1][:5]
+        np.testing.assert_allclose(np.abs(pairs['Корреляция']), expected)
+        self.assertTrue((pairs['Продукт 1'] != pairs['Продукт 2']).all())
+
+    def test_large_matrix_rendered_as_raster(self):
+        """Тест растровой карты без подписей ячеек для большого каталога"""
+        results, processed_df = analyze_sales_data(self.df)
+        figure = create_correlation_figure(processed_df, results, reorder=True)
+
+        self.assertEqual(len(figure.axes[0].images), 1)
+        self.assertEqual(len(figure.axes[0].texts), 0)
+        plt.close(figure)
+
+
+class TestOnDemandSections(unittest.TestCase):
+    """Тесты построения разделов анализа по требованию"""
+
+    def setUp(self):
+        """Подготовка данных для тестов"""
+        self.df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=12, freq='MS'),
+            'A': np.arange(12) * 10,
+            'B': np.arange(12) % 4,
+        })
+
+    def test_only_selected_section_rendered(self):
+        """Тест вызова только выбранного раздела и всех разделов без выбора"""
+        names = ['render_statistics', 'render_key_metrics', 'render_visualizations',
+                 'render_report']
+        for section, expected in [(ANALYSIS_SECTIONS[2], ['render_visualizations']),
+                                  (None, names)]:
+            with self.subTest(section=section):
+                mocks = {name: MagicMock() for name in names}
+                with patch.multiple(streamlit_app, **mocks):
+                    render_analysis({}, None, 12, section=section)
+
+                self.assertEqual([name for name in names if mocks[name].called], expected)
+
+    def test_results_reused_between_reruns(self):
+        """Тест переиспользования ленивых результатов для того же набора"""
+        with patch.object(streamlit_app.st, 'session_state', {}):
+            results, _ = session_analysis(self.df)
+            results['total_sales_per_product']
+
+            again, _ = session_analysis(self.df)
+            self.assertIs(again, results)
+            self.assertIn('total_sales_per_product', again.computed)
+
+            self.assertIsNot(session_analysis(self.df.copy())[0], results)
+            self.assertIsNot(session_analysis(self.df, approximate=True)[0], results)
+
+    def test_report_trend_relative_to_monthly_totals(self):
+        """Тест доли тренда в отчете относительно среднего месячного итога"""
+        daily = pd.DataFrame({'Дата': pd.date_range('2020-01-01', '2020-06-30', freq='D')})
+        daily['A'] = daily['Дата'].dt.month * 10
+        results, processed_df = analyze_sales_data(daily)
+        share = results['total_sales_trend'] / results['monthly_sales'].sum(axis=1).mean()
+
+        with patch.object(streamlit_app.st, 'header'), \
+                patch.object(streamlit_app.st, 'download_button'), \
+                patch.object(streamlit_app.st, 'markdown') as mock_markdown:
+            streamlit_app.render_report(results, len(processed_df))
+
+        self.assertIn(f"({share:+.1%} от среднего)", mock_markdown.call_args[0][0])
+
+
+@unittest.skipIf(streamlit_app.go is None, "plotly не установлен")
+class TestPlotlyBackend(unittest.TestCase):
+    """Тесты интерактивных графиков Plotly"""
+
+    def test_small_dataset(self):
+        """Тест графиков для небольших данных: SVG-трасса и подписи ячеек"""
+        df = pd.DataFrame({
+            'Дата': pd.date_range('2020-01-01', periods=12, freq='MS'),
+            'A': np.arange(12) * 10,
+            'B': np.arange(12)[::-1] * 5,
+        })
+        results, processed_df = analyze_sales_data(df)
+        fig1, fig2, fig3 = create_visualizations(processed_df, results, backend='plotly')
+
+        self.assertEqual(fig1.data[0].type, 'scatter')
+        self.assertEqual(len(fig1.data[0].x), 12)
+        self.assertEqual(list(fig2.data[0].x), ['A', 'B'])
+        self.assertEqual(fig3.data[0].texttemplate, '%{z:.2f}')
+
+    def test_long_series_uses_webgl(self):
+        """Тест WebGL-трассы для длинного ряда"""
+        df = pd.DataFrame({'Дата': pd.date_range('2000-01-01', periods=5000),
+                           'A': np.random.default_rng(0).normal(size=5000)})
+        results, processed_df = analyze_sales_data(df)
+        fig1, _, _ = create_visualizations(processed_df, results, backend='plotly')
+
+        self.assertEqual(fig1.data[0].type, 'scattergl')
+        self.assertEqual(len(fig1.data[0].x), 5000)
+        self.assertEqual(fig1.data[0].mode, 'lines')
+
+
 if __name__ == '__main__':
     # Запуск тестов с подробным выводом
     unittest.main(verbosity=2)
\ No newline at end of file
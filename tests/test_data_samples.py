@@ -12,7 +12,8 @@ import os
 # Добавляем корневую директорию в PYTHONPATH
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from streamlit_app import analyze_sales_data
+from streamlit_app import analyze_sales_data, detect_date_column, parse_dates, infer_date_format
+from streamlit_app import pivot_long_sales
 
 
 @pytest.mark.unit
@@ -201,6 +202,57 @@ class TestDataSamples:
         assert pd.api.types.is_datetime64_any_dtype(processed_df.index)
         assert len(processed_df) == 3
     
+    def test_russian_date_format_in_other_column(self):
+        """Тест определения дат формата dd.mm.yyyy в столбце с другим названием"""
+        russian_df = pd.DataFrame({
+            'Продукт_1': [100, 200, 300],
+            'Период': ['01.01.2020', '01.02.2020', '13.03.2020'],
+            'Продукт_2': [10, 20, 30]
+        })
+
+        assert detect_date_column(russian_df) == (1, '%d.%m.%Y')
+        results, processed_df = analyze_sales_data(russian_df.copy())
+
+        assert list(processed_df.columns) == ['Продукт_1', 'Продукт_2']
+        assert processed_df.index[2] == pd.Timestamp('2020-03-13')
+        assert results['month_highest_sales'] == pd.Timestamp('2020-03-13')
+
+    def test_excel_serial_dates(self):
+        """Тест разбора дат в виде порядковых номеров Excel"""
+        serial_df = pd.DataFrame({
+            'Date': [43831, 43862, 43891],  # 2020-01-01, 2020-02-01, 2020-03-01
+            'Продукт_1': [100, 200, 300]
+        })
+
+        position, date_format = detect_date_column(serial_df)
+        assert (position, date_format) == (0, 'excel')
+        dates = parse_dates(serial_df['Date'], date_format)
+        assert list(dates) == list(pd.date_range('2020-01-01', periods=3, freq='MS'))
+
+    def test_sales_values_not_detected_as_dates(self):
+        """Тест того, что числовые продажи не принимаются за даты Excel"""
+        sales_df = pd.DataFrame({
+            'Продукт_1': [43831, 43862, 43891],
+            'Продукт_2': [25000, 30000, 35000]
+        })
+
+        assert detect_date_column(sales_df) == (None, None)
+
+    def test_date_hint_inside_product_name(self):
+        """Тест того, что «датное» слово внутри названия продукта не делает его датой"""
+        sales_df = pd.DataFrame({
+            'Monday': [43831, 43862, 43891],
+            'Продажи в день': [25000, 30000, 35000]
+        })
+
+        assert detect_date_column(sales_df) == (None, None)
+
+    def test_excel_serial_dates_require_sorted_integers(self):
+        """Тест того, что дробные или убывающие числа не принимаются за даты Excel"""
+        assert infer_date_format(pd.Series([43831.5, 43862.0, 43891.0], name='Дата')) is None
+        assert infer_date_format(pd.Series([43891, 43862, 43831], name='Дата')) is None
+        assert infer_date_format(pd.Series([43831, 43862, 43891], name='Дата продажи')) == 'excel'
+
     def test_unicode_column_names(self):
         """Тест с названиями столбцов в Unicode"""
         unicode_df = pd.DataFrame({
@@ -279,5 +331,43 @@ class TestRealWorldScenarios:
         assert len(results['total_sales_per_product']) == 4
 
 
+@pytest.mark.unit
+class TestLongFormatData:
+    """Тесты сведения транзакций в широкую таблицу"""
+
+    @pytest.fixture
+    def transactions(self):
+        """Транзакции в длинном формате"""
+        return pd.DataFrame({
+            'Дата': ['05.01.2020', '17.01.2020', '03.02.2020', '28.02.2020', '10.04.2020'],
+            'Продукт': ['Б', 'А', 'А', 'Б', 'А'],
+            'Сумма': [10, 20, 30, 40, 50]
+        })
+
+    def test_monthly_pivot(self, transactions):
+        """Тест помесячного сведения с пустым месяцем"""
+        wide = pivot_long_sales(transactions, 'Дата', 'Продукт', 'Сумма')
+
+        assert list(wide.columns) == ['Дата', 'А', 'Б']
+        assert list(wide['Дата']) == list(pd.date_range('2020-01-01', periods=4, freq='MS'))
+        assert list(wide['А']) == [20, 30, 0, 50]
+        assert list(wide['Б']) == [10, 40, 0, 0]
+
+    def test_weekly_pivot(self, transactions):
+        """Тест понедельного сведения: недели начинаются с понедельника"""
+        wide = pivot_long_sales(transactions, 'Дата', 'Продукт', 'Сумма', freq='W')
+
+        assert (wide['Дата'].dt.dayofweek == 0).all()
+        assert wide[['А', 'Б']].to_numpy().sum() == 150
+
+    def test_pivot_feeds_analysis(self, transactions):
+        """Тест анализа сведенной таблицы"""
+        wide = pivot_long_sales(transactions, 'Дата', 'Продукт', 'Сумма')
+        results, processed_df = analyze_sales_data(wide)
+
+        assert results['total_sales_per_product']['А'] == 100
+        assert results['month_highest_sales'] == pd.Timestamp('2020-02-01')
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
\ No newline at end of file